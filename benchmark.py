@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Benchmarks for the Battle Line engine and bots.
+
+Measures games per second for every pairing of players, the time per call of
+the engine's hot paths, random playouts per second, and the hit rates of the
+caches in bot_utils.  Each timing is the best of a few repeats, so that noise
+doesn't pass for a regression.  Results are written as JSON.  Given a baseline
+(the JSON of an earlier run), also lists every timing that got worse by more
+than a tolerance, and exits with status 1 if any did.
+
+All games are seeded, so two builds are timed on the same deals (as long as
+the players' own choices haven't changed).
+"""
+
+import sys, argparse, json, time, itertools, functools
+from bl_classes import *
+from tournament import availablePlayers, make_players, play_rounds
+
+# Search players spend a fixed time per move, so their games per second
+# measure their budget rather than the engine.  Benchmark them by name.
+TIME_BUDGETED_PLAYERS = ('mcts',)
+
+
+def cache_hit_rates():
+    """Return each cache's hits / (hits + misses) so far."""
+    rates = {}
+    for name, stats in cache_stats().items():
+        if stats.hits + stats.misses > 0:
+            rates[name] = stats.hits / (stats.hits + stats.misses)
+    return rates
+
+def time_games(playerNames, nGames, seed, repeats=1):
+    """Return games per second for one pairing (seats alternate), the best
+    of repeats."""
+    rates = []
+    for iRepeat in range(repeats):
+        start = time.perf_counter()
+        for i in range(nGames):
+            pair = playerNames
+            if i % 2 == 1:
+                pair = pair[::-1]
+            list(play_rounds(pair, pair, 1, '{}:{}'.format(seed, i)))
+        rates.append(nGames / (time.perf_counter() - start))
+    return max(rates)
+
+def sample_positions(nGames, seed):
+    """Play seeded games (Tactful vs Naive) and keep a snapshot every turn.
+
+    Returns the Round of the last game (to restore snapshots into) and the
+    snapshots.
+    """
+    positions = []
+    for i in range(nGames):
+        players = make_players(['tactful', 'naive'])
+        r = Round(players, ['Tactful', 'Naive'], False,
+                  rng=random.Random('{}:positions:{}'.format(seed, i)))
+        r.generate_decks_and_deal_hands()
+        passes = 0
+        while r.winner == None and passes < 2:
+            positions.append(r.snapshot())
+            play = players[r.whoseTurn].play(r)
+            passes = passes + 1 if play[0] == None else 0
+            r.apply_move(play, players[r.whoseTurn])
+            r.undoStack = []
+    return r, positions
+
+def time_calls(r, positions, calls, repeats=1):
+    """Return microseconds per call, over every position (the best of
+    repeats).
+
+    calls (function): Given the Round, returns a list of zero-argument
+                      functions to time at that position
+    """
+    times = []
+    for iRepeat in range(repeats):
+        nCalls, elapsed = 0, 0.0
+        for state in positions:
+            r.restore(state)
+            todo = calls(r)
+            start = time.perf_counter()
+            for call in todo:
+                call()
+            elapsed += time.perf_counter() - start
+            nCalls += len(todo)
+        times.append(1e6 * elapsed / max(nCalls, 1))
+    return min(times)
+
+def micro_benchmarks(nGames, seed, repeats=1):
+    """Time the engine's hot paths at positions from real games."""
+    r, positions = sample_positions(nGames, seed)
+
+    def formations(r):
+        return [functools.partial(detect_formation.__wrapped__,
+                                  tuple(f.played[p]), f.special)
+                for f in r.flags for p in range(N_PLAYERS)
+                if len(f.played[p]) >= FORMATION_SIZE]
+
+    def best_cases(r):
+        return [functools.partial(r.best_case, f.played[p], f.special)
+                for f in r.flags for p in range(N_PLAYERS)]
+
+    def best_empties(r):
+        return [functools.partial(r.best_empty, mud) for mud in (False, True)]
+
+    def wins(r):
+        return [functools.partial(find_play_to_win_flag, r, card, i,
+                                  r.whoseTurn)
+                for card in TACTICS for i in range(N_FLAGS)]
+
+    def winners(r):
+        return [r.check_winner]
+
+    clear_caches()
+    return {name : time_calls(r, positions, calls, repeats)
+            for name, calls in (('detect_formation (uncached)', formations),
+                                ('best_case', best_cases),
+                                ('best_empty', best_empties),
+                                ('find_play_to_win_flag', wins),
+                                ('check_winner', winners))}
+
+def playout_benchmarks(nGames, seed, batch=1000, repeats=1):
+    """Return random playouts per second from positions in real games, run
+    in batches (side by side, with NumPy) and one at a time (the best of
+    repeats)."""
+    r, positions = sample_positions(nGames, seed)
+    positions = positions[::10]
+    rng = random.Random(seed)
+    rates = {}
+    for label, size in (('random_playouts (batch of {})'.format(batch),
+                         batch),
+                        ('random_playouts (one at a time)', 1)):
+        rates[label] = 0.0
+        for iRepeat in range(repeats):
+            nPlayouts, elapsed = 0, 0.0
+            for state in positions:
+                r.restore(state)
+                start = time.perf_counter()
+                for i in range(max(batch // size // 10, 1)):
+                    stats = random_playouts(r, size, rng, r.whoseTurn)
+                    nPlayouts += stats.playouts
+                elapsed += time.perf_counter() - start
+            rates[label] = max(rates[label], nPlayouts / elapsed)
+    return rates
+
+def run(players, nGames, nPositionGames, seed, repeats=1):
+    """Run every benchmark and return the results (dict)."""
+    results = {'games per second':{}, 'microseconds per call':{},
+               'playouts per second':{}, 'cache hit rate':{}, 'seed':seed}
+
+    clear_caches()
+    for pair in itertools.combinations_with_replacement(players, 2):
+        label = ' vs '.join(pair)
+        print('Timing {}...'.format(label), file=sys.stderr)
+        results['games per second'][label] = time_games(list(pair), nGames,
+                                                        seed, repeats)
+    results['cache hit rate'] = cache_hit_rates()
+
+    print('Timing hot paths...', file=sys.stderr)
+    results['microseconds per call'] = micro_benchmarks(nPositionGames, seed,
+                                                        repeats)
+    print('Timing playouts...', file=sys.stderr)
+    results['playouts per second'] = playout_benchmarks(
+        nPositionGames, seed, repeats=repeats)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print changes against a baseline.  Return the list of regressions."""
+    regressions = []
+    for section, higherIsBetter in (('games per second', True),
+                                    ('microseconds per call', False),
+                                    ('playouts per second', True)):
+        for name, new in sorted(results[section].items()):
+            old = baseline.get(section, {}).get(name)
+            if not old:
+                continue
+            speedup = new / old if higherIsBetter else old / new
+            flag = ''
+            if speedup < 1 - tolerance:
+                flag = '  <-- REGRESSION'
+                regressions.append(name)
+            print('{:45} {:10.2f} -> {:10.2f}  ({:+.0%}){}'.format(
+                  name, old, new, speedup - 1, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine and '
+                                                 'bots.')
+    parser.add_argument('players', metavar='player', type=str, nargs='*',
+        help='players to pair up (default: all but {})'.format(
+             ', '.join(TIME_BUDGETED_PLAYERS)))
+    parser.add_argument('-n', '--n_games', default=20, type=int,
+        help='games per pairing')
+    parser.add_argument('-p', '--n_position_games', default=10, type=int,
+        help='games to sample hot-path positions from')
+    parser.add_argument('-r', '--repeats', default=3, type=int,
+        help='times to run each timing (the best run counts)')
+    parser.add_argument('-s', '--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default='benchmark.json',
+        help='where to write results (JSON)')
+    parser.add_argument('-b', '--baseline', default=None,
+        help='earlier results (JSON) to compare against')
+    parser.add_argument('-t', '--tolerance', default=0.1, type=float,
+        help='slowdown allowed before flagging a regression')
+    args = parser.parse_args()
+
+    players = args.players or sorted(name for name in availablePlayers
+                                     if name not in TIME_BUDGETED_PLAYERS)
+    for name in players:
+        assert name in availablePlayers
+
+    results = run(players, args.n_games, args.n_position_games, args.seed,
+                  args.repeats)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline == None:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if compare(results, baseline, args.tolerance) != []:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
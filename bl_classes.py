@@ -23,9 +23,51 @@ TACTICS          = {'Al':'Alexander',      'Co':'Companion Cavalry',
                     'Sh':'Shield Bearers', 'Tr':'Traitor'}
 
 
-import random, sys, copy, itertools, functools
+import random, sys, copy, itertools, functools, array, collections, time
+import signal, threading, contextlib
+try:
+    import numpy
+except ImportError: # Optional: speeds up best_case_batch and playouts.
+    numpy = None
 from bot_utils import *
 
+TimeControl = collections.namedtuple('TimeControl',
+                                     ['moveTime', 'gameTime', 'forfeit'])
+TimeControl.__doc__ = """Time budgets for each player's moves in a round.
+
+moveTime (float or None): Seconds allowed per move (None for no limit)
+gameTime (float or None): Seconds allowed for all of a player's moves
+forfeit (bool): Whether running out loses the round (else a default move
+                is played for the player; see Round.default_play)
+"""
+
+
+class MoveTimeout(Exception):
+    """Raised inside a player's move when its time is up."""
+
+@contextlib.contextmanager
+def move_alarm(seconds):
+    """Raise MoveTimeout inside this block once seconds have passed.
+
+    Needs a timer signal, so works only on the main thread of platforms with
+    signal.setitimer (e.g., not Windows).  Elsewhere, or if seconds is None,
+    does nothing.
+    """
+    if seconds == None or not hasattr(signal, 'setitimer') or \
+            threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def interrupt(signum, frame):
+        raise MoveTimeout()
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
 
 class Player():
     """Class to inherit when making a new AI player.
@@ -54,35 +96,62 @@ class Player():
         """Override to return a list of two discards after playing Scout."""
         raise Exception('Must override this method')
 
+    def round_ended(self, r):
+        """Override to tidy up when a round ends (e.g., stop processes)."""
+        pass
+
 
 class Round():
     """Store round info and interact with AI players.
 
     Methods that interact with AIs: 'get_play', 'get_scout_discards'
 
-    Formation dicts are explained in 'detect_formation' (bot_utils.py).
+    Formations are explained in 'Formation' (bot_utils.py).
 
-    best & bestMud (dict): Best formation reachable at an empty flag
+    best & bestMud (Formation): Best formation reachable at an empty flag
+    emptyCursors (dict): Search progress of best_empty for each flag size
     flags (list of 9 Flag): See Flag class
+    wonMasks (list of 2 int): Bitmask of the flags each player has won
+    openMasks (list of 2 int): Bitmask of the flags where each player still
+                               has room (see open_flags)
     h (list of 2 Hand): See Hand class
     playedLeader (int or None): Who (player 0 or 1) played Alexander or Darius
     tacticsAdvantage (int or None): Who has played fewer tactics cards
     winner (int or None): Who won the round
     whoseTurn (int): Current player
     verbose (bool): Whether to print play-by-play output (or just state winner)
+    undoStack (list): Snapshots for undo_move (see snapshot)
+    dirtyFlags (set of int): Flags that may have changed during this play
+    timeControl (TimeControl or None): Time budgets (None for no limits)
+    clocks (list of 2 float): Seconds each player has spent on moves
+    overruns (list of 2 int): Moves each player ran out of time on
+    moveDeadline (float or None): time.perf_counter() when the current move
+                                  must be in (see time_left)
+    rng (random.Random): Source of all randomness in the round; players
+                         should draw from it too, so rounds can be replayed
     cardsLeft (dict): Lists of cards publicly remaining in each deck
+    initialDecks (dict): Tuples of each deck's order before the deal
+    poolMask (int): Bitmask of the same cards (see CARD_CODES in bot_utils.py)
     decks (dict): Lists of ordered draw piles for each deck (don't cheat!)
     """
 
-    def __init__(self, players, names, verbose):
-        """Instantiate a Round and its Flag and Hand sub-objects."""
+    def __init__(self, players, names, verbose, timeControl=None, rng=None):
+        """Instantiate a Round and its Flag and Hand sub-objects.
+
+        rng (random.Random): The round's own RNG, for shuffling and for the
+                             players (a new, unseeded one if not given)
+        """
         initialBest = detect_formation(
             tuple(v+TROOP_SUITS[0] for v in TROOP_CONTENTS[-3:])) # Red 7-9
         self.best = initialBest
+        self.emptyCursors = {size : dict.fromkeys(candidates, 0) for size,
+                             candidates in EMPTY_FLAG_CANDIDATES.items()}
         initialBestMud = detect_formation(
             tuple(v+TROOP_SUITS[0] for v in TROOP_CONTENTS[-4:])) # Red 6-9
         self.bestMud = initialBestMud
         self.flags = [self.Flag(initialBest) for i in range(N_FLAGS)]
+        self.wonMasks = [0] * N_PLAYERS
+        self.openMasks = [(1 << N_FLAGS) - 1] * N_PLAYERS
 
         self.h = [self.Hand(i, names[i]) for i in range(N_PLAYERS)]
 
@@ -91,15 +160,34 @@ class Round():
         self.winner = None
         self.whoseTurn = 0
         self.verbose = verbose
-
-    def generate_decks_and_deal_hands(self):
-        """Construct decks, shuffle, and deal."""
+        self.undoStack = [] # Snapshots saved by apply_move
+        self.dirtyFlags = set() # Flags to try to resolve after this play
+        self.timeControl = timeControl
+        self.clocks = [0.0] * N_PLAYERS
+        self.overruns = [0] * N_PLAYERS
+        self.moveDeadline = None
+        self.rng = rng if rng != None else random.Random()
+
+    def generate_decks_and_deal_hands(self, decks=None):
+        """Construct decks, shuffle, and deal.
+
+        decks (dict): If given, deal these deck orders (e.g., initialDecks
+                      from an earlier round) instead of shuffling
+        """
         troopDeck = [n + s for n in TROOP_CONTENTS for s in TROOP_SUITS]
         tacticsDeck = [key for key in TACTICS]
 
         self.cardsLeft = {'troop':troopDeck[:], 'tactics':tacticsDeck[:]}
+        self.poolMask = TROOP_MASK | TACTICS_MASK
+        self.poolSummary = (None, None) # Pool mask and its pool_summary
 
-        [random.shuffle(d) for d in (troopDeck, tacticsDeck)]
+        if decks == None:
+            [self.rng.shuffle(d) for d in (troopDeck, tacticsDeck)]
+        else:
+            troopDeck, tacticsDeck = list(decks['troop']), \
+                                     list(decks['tactics'])
+        self.initialDecks = {'troop':tuple(troopDeck),
+                             'tactics':tuple(tacticsDeck)}
         self.decks = {'troop':troopDeck, 'tactics':tacticsDeck}
 
         [h.add(self.draw('troop')) for h in self.h for i in range(HAND_SIZE)]
@@ -109,6 +197,24 @@ class Round():
         if deckName and self.decks[deckName] != []:
             return self.decks[deckName].pop()
 
+    def remove_from_pool(self, card):
+        """Mark a card as no longer publicly remaining (it was played)."""
+        if card in TACTICS:
+            self.cardsLeft['tactics'].remove(card)
+        else:
+            self.cardsLeft['troop'].remove(card)
+        self.poolMask &= ~CARD_BITS[card]
+
+        for i, f in enumerate(self.flags): # Defender's best may be gone.
+            if f.winner == None and (card in f.best[0].cards or
+                                     card in f.best[1].cards):
+                self.dirtyFlags.add(i)
+
+        if card in self.best.cards:
+            self.best = self.best_empty()
+        if card in self.bestMud.cards:
+            self.bestMud = self.best_empty(True)
+
     def replace_card(self, card, hand, deckName):
         """Discard from hand, then draw (if a deck is specified)."""
         hand.drop(card)
@@ -136,22 +242,185 @@ class Round():
 
     def get_play(self, player):
         """Execute AI's play for current turn.  Return the play."""
-        me = self.whoseTurn
+        if self.timeControl != None:
+            return self.get_timed_play(player)
+        return self.ask_for_play(player)
+
+    def ask_for_play(self, player):
+        """Get and execute the AI's play, with no time limit."""
         card, target, deckName = player.play(self)
 
-        if card == None: # Player passed; do nothing (TODO: check legality).
+        if card == None: # Player passed; do nothing.
+            assert self.can_pass() # Legal pass
             return None
 
+        return self.make_play(card, target, deckName, player)
+
+    def get_timed_play(self, player):
+        """Same as get_play, but within the player's time budget.
+
+        A player still thinking when time is up is interrupted, and any
+        changes made to the round during the move are undone.  (Where that
+        isn't possible, see move_alarm, a late move stands.)  Either way, it
+        counts as an overrun: the player forfeits, or if an interrupted move
+        is not to forfeit, a default move is played instead.
+        """
+        me = self.whoseTurn
+        timeLeft = self.time_left()
+        start = time.perf_counter()
+        if timeLeft != None:
+            self.moveDeadline = start + timeLeft
+
+        state = self.snapshot()
+        play, interrupted = None, False
+        try:
+            if timeLeft != None and timeLeft <= 0:
+                raise MoveTimeout()
+            with move_alarm(timeLeft):
+                play = self.ask_for_play(player)
+        except MoveTimeout:
+            self.restore(state)
+            interrupted = True
+        elapsed = time.perf_counter() - start
+        self.clocks[me] += elapsed
+        self.moveDeadline = None
+
+        if not interrupted and (timeLeft == None or elapsed <= timeLeft):
+            return play
+        self.overruns[me] += 1
+        if self.timeControl.forfeit:
+            self.winner = 1 - me
+            return None
+        if interrupted:
+            card, target, deckName = self.default_play()
+            if card == None:
+                return None
+            return self.make_play(card, target, deckName)
+        return play
+
+    def time_left(self, p=None):
+        """Return seconds left for a player's move (None for no limit).
+
+        By default, for the current player.  During a move, counts down to
+        the move's deadline; players may call this to plan their search.
+        """
+        if self.timeControl == None:
+            return None
+        if p == None:
+            p = self.whoseTurn
+        if p == self.whoseTurn and self.moveDeadline != None:
+            return max(0.0, self.moveDeadline - time.perf_counter())
+
+        moveTime, gameTime, forfeit = self.timeControl
+        if gameTime != None:
+            gameTime -= self.clocks[p]
+        budgets = [t for t in (moveTime, gameTime) if t != None]
+        if budgets == []:
+            return None
+        return max(0.0, min(budgets))
+
+    def default_play(self):
+        """Return a quick legal play for the current player, or a pass.
+
+        Played for a player who runs out of time: the first troop in hand at
+        the first flag open to it.
+        """
+        me = self.whoseTurn
+        troops = [c for c in self.h[me].cards if c not in TACTICS]
+        flags = self.open_flags(me)
+        if troops == [] or flags == ():
+            return None, None, None
+        return troops[0], flags[0], self.prefer_deck('troop')
+
+    def open_flags(self, p=None):
+        """Return the flags (tuple of int) where a player (by default, the
+        current one) can still play a troop."""
+        if p == None:
+            p = self.whoseTurn
+        return OPEN_FLAGS[self.openMasks[p]]
+
+    def can_pass(self):
+        """Check whether the current player may pass: only when no troop in
+        hand can be played."""
+        return self.open_flags() == () or \
+               all(c in TACTICS for c in self.h[self.whoseTurn].cards)
+
+    def legal_moves(self):
+        """Yield every legal (card, target, deckName) play for the current
+        player (not passes; see can_pass).
+
+        Targets take each form play_tactics accepts.  Scout's deckName is
+        None (its discards are asked for when it is played), and so is any
+        play's once both decks are empty.
+        """
+        me, you = self.whoseTurn, 1 - self.whoseTurn
+        openFlags = self.open_flags(me)
+        deckNames = [d for d in ('troop', 'tactics') if self.decks[d]] or \
+                    [None]
+        tacticsTargets = {}
+        if self.tacticsAdvantage != you: # Else no tactics for now
+            tacticsTargets = self.tactics_targets(me, openFlags)
+
+        for card in self.h[me].cards:
+            if card not in TACTICS:
+                for target in openFlags:
+                    for deckName in deckNames:
+                        yield card, target, deckName
+            elif card == 'Sc':
+                for target in tacticsTargets.get(card, ()):
+                    yield card, target, None
+            else:
+                for target in tacticsTargets.get(card, ()):
+                    for deckName in deckNames:
+                        yield card, target, deckName
+
+    def tactics_targets(self, me, openFlags):
+        """Return each legal target (list) of each tactics card in hand."""
+        you = 1 - me
+        unsettled = [i for i, f in enumerate(self.flags) if f.winner == None]
+        targets = {}
+        for card in self.h[me].cards:
+            if card in ('Al', 'Da'):
+                if self.playedLeader != me:
+                    targets[card] = openFlags
+            elif card in ('Co', 'Sh'):
+                targets[card] = openFlags
+            elif card in ('Fo', 'Mu'):
+                targets[card] = unsettled
+            elif card == 'Sc':
+                if len(self.decks['troop']) + len(self.decks['tactics']) >= 3:
+                    targets[card] = list(itertools.product(('troop',
+                                                            'tactics'),
+                                                           repeat=3))
+            elif card == 'De':
+                targets[card] = [(c,) for i in unsettled
+                                 for c in self.flags[i].played[you]]
+            elif card == 'Tr': # Troops only, to anywhere or nowhere
+                targets[card] = [(c, j) for i in unsettled
+                                 for c in self.flags[i].played[you]
+                                 if c not in TACTICS
+                                 for j in openFlags + (None,)]
+            elif card == 'Re': # To anywhere or nowhere
+                targets[card] = [(c, j) for i in unsettled
+                                 for c in self.flags[i].played[me]
+                                 for j in openFlags + (None,)]
+        return targets
+
+    def make_play(self, card, target, deckName, scoutPlayer=None):
+        """Execute a play for the current player.  Return the play.
+
+        scoutPlayer (Player): Chooses the discards if the card is Scout
+        """
+        me = self.whoseTurn
+        self.remove_from_pool(card)
         if card in TACTICS:
-            self.cardsLeft['tactics'].remove(card)
             self.play_tactics(card, target)
             self.update_tactics_advantage()
         else: # Troop
-            self.cardsLeft['troop'].remove(card)
             self.play_troop(card, target)
 
         if card == 'Sc':
-            deckName = self.get_scout_discards(player) # 2-list
+            deckName = self.get_scout_discards(scoutPlayer) # 2-list
             # Discard Scout.  Don't draw normally this turn.
             self.replace_card(card, self.h[me], None)
         else: # Draw a new card as usual.
@@ -179,7 +448,8 @@ class Round():
         flag = self.flags[target]
 
         assert flag.slots_left(me) > 0 # Legal play
-        flag.played[me].append(card)
+        flag.add_card(me, card)
+        self.dirtyFlags.add(target)
 
     def play_tactics(self, card, target):
         me = self.whoseTurn
@@ -203,30 +473,30 @@ class Round():
                 else: # Re
                     startSide, endSide = me, me
 
-            for f in self.flags:
-                if targetCard in f.played[startSide]:
-                    f.played[startSide].remove(targetCard)
-                    self.update_flag(f, None, True)
+            for i, f in enumerate(self.flags):
+                if f.playedMask[startSide] & CARD_BITS[targetCard]:
+                    f.remove_card(startSide, targetCard)
+                    self.dirtyFlags.add(i)
                     break
             else:
                 raise Exception('Target not found')
 
             if targetDestination != None:
                 f = self.flags[targetDestination]
-                f.played[endSide].append(targetCard)
-                self.update_flag(f, None, True)
+                f.add_card(endSide, targetCard)
+                self.dirtyFlags.add(targetDestination)
 
         elif card == 'Fo':
             self.flags[target].special = list(self.flags[target].special)
             self.flags[target].special.append('fog')
             self.flags[target].special = tuple(self.flags[target].special)
-            self.update_flag(self.flags[target], None, True)
+            self.dirtyFlags.add(target)
 
         elif card == 'Mu':
             self.flags[target].special = list(self.flags[target].special)
             self.flags[target].special.append('mud')
             self.flags[target].special = tuple(self.flags[target].special)
-            self.update_flag(self.flags[target], None, True)
+            self.dirtyFlags.add(target)
 
         else: # Al, Da, Co, or Sh
             if card in ('Al', 'Da'):
@@ -236,20 +506,84 @@ class Round():
 
     def best_case(self, cards, special=()):
         """Return the best formation attainable for a group of cards."""
-        cards = list(cards)
-        cardOptions = [list(tup) for tup in
-            itertools.product(*[card_options(card) for card in cards])]
-        if len(cardOptions) == 1:
+        if TACTICS.keys().isdisjoint(cards):
             return self.best_case_no_wilds(tuple(cards), special)
-        else:
-            formations = list(map(
-                lambda cards: self.best_case_no_wilds(tuple(cards), special),
-                              cardOptions))
-            bestFormation = formations[0]
-            for formation in formations[1:]:
-                if compare_formations([formation, bestFormation], 0) == 0:
-                    bestFormation = formation
-            return bestFormation
+        return best_wild_formation(tuple(cards), tuple(special),
+                                   self.poolMask & TROOP_MASK)
+
+    def best_case_batch(self, candidates, specials):
+        """Return the best_case strength (int) for each group of cards.
+
+        candidates (list of seq): Groups of cards, e.g., a hand card plus the
+                                  cards already played at a flag
+        specials (list of tuple): Each group's flag.special
+
+        The public pool is summarized once for the whole batch, and groups
+        without wild tactics are scored against that summary rather than by
+        searching the pool one group at a time.  Large batches are scored in
+        one vectorized pass if NumPy is installed (below NUMPY_MIN_BATCH
+        groups, NumPy's per-call overhead outweighs its speed).
+        """
+        pool = self.pool_summary()
+        useNumpy = numpy != None and len(candidates) >= NUMPY_MIN_BATCH
+        strengths, simple = [], []
+        for cards, special in zip(candidates, specials):
+            if not cards or not TACTICS.keys().isdisjoint(cards): # Wilds
+                strengths.append(self.best_case(cards, special).strength)
+            elif useNumpy:
+                simple.append(len(strengths))
+                strengths.append(None) # Filled in below
+            else:
+                strengths.append(group_strength(
+                    summarize_group(tuple(cards), special), pool))
+
+        if simple != []:
+            batchStrengths = batch_strengths_numpy(
+                [summarize_group(tuple(candidates[i]), specials[i])
+                 for i in simple], pool)
+            for i, strength in zip(simple, batchStrengths):
+                strengths[i] = strength
+        return strengths
+
+    def pool_summary(self):
+        """Summarize the troops left in the public pool (see group_strength).
+
+        Returns a dict with value masks per suit ('suitValues'), card counts
+        per value ('valueCounts'), a mask of every value left
+        ('availableValues'), and the sums of the n strongest cards left, per
+        suit ('suitTops') and overall ('allTops').  Cached until the pool
+        changes.
+        """
+        if self.poolSummary[0] == self.poolMask:
+            return self.poolSummary[1]
+
+        suitValues = [0] * N_SUITS
+        valueCounts = [0] * N_VALUES
+        suitTops = [[0] * (FORMATION_SIZE + 2) for s in range(N_SUITS)]
+        allTops = [0] * (FORMATION_SIZE + 2)
+        nSeen = 0
+        for card in mask_to_cards(self.poolMask & TROOP_MASK): # Strongest 1st
+            value, s = divmod(CARD_CODES[card], N_SUITS)
+            suitValues[s] |= 1 << value
+            valueCounts[value] += 1
+            nSuitSeen = POPCOUNTS[suitValues[s]]
+            if nSuitSeen <= FORMATION_SIZE + 1:
+                suitTops[s][nSuitSeen] = suitTops[s][nSuitSeen - 1] + value
+            nSeen += 1
+            if nSeen <= FORMATION_SIZE + 1:
+                allTops[nSeen] = allTops[nSeen - 1] + value
+        for tops in suitTops + [allTops]: # Too few cards: use what's left.
+            for j in range(1, len(tops)):
+                tops[j] = max(tops[j], tops[j - 1])
+
+        availableValues = 0
+        for values in suitValues:
+            availableValues |= values
+        summary = {'suitValues':suitValues, 'valueCounts':valueCounts,
+                   'availableValues':availableValues,
+                   'suitTops':suitTops, 'allTops':allTops}
+        self.poolSummary = (self.poolMask, summary)
+        return summary
 
     def best_case_no_wilds(self, cards, special=()):
         """Same as best_case, but assumes no wild tactics present."""
@@ -279,8 +613,7 @@ class Round():
             if flush:
                 for s in possibleStraights:
                     for value in s:
-                        card = value + firstSuit
-                        if card not in self.cardsLeft['troop']:
+                        if not self.poolMask & CARD_BITS[value + firstSuit]:
                             break
                     else:
                         return detect_formation(\
@@ -288,31 +621,35 @@ class Round():
                             special)
 
         if triple:
-            formation = copy.copy(cards)
-            for card in self.cardsLeft['troop']:
-                if card[0] == firstValue:
-                    formation += [card]
-                    if len(formation) == formationSize:
-                        return detect_formation(tuple(formation), special)
+            sameValue = self.poolMask & VALUE_MASKS[firstValue]
+            nMissing = formationSize - len(cards)
+            if bin(sameValue).count('1') >= nMissing:
+                formation = copy.copy(cards)
+                while len(formation) < formationSize:
+                    card = lowest_card(sameValue)
+                    formation.append(card)
+                    sameValue ^= CARD_BITS[card]
+                return detect_formation(tuple(formation), special)
 
         if flush:
-            formation = copy.copy(cards)
-            for value in TROOP_CONTENTS[::-1]:
-                if value + firstSuit in self.cardsLeft['troop']:
-                    formation.append(value + firstSuit)
-                    if len(formation) == formationSize:
-                        return detect_formation(tuple(formation), special)
+            sameSuit = self.poolMask & SUIT_MASKS[firstSuit]
+            nMissing = formationSize - len(cards)
+            if bin(sameSuit).count('1') >= nMissing:
+                formation = copy.copy(cards)
+                while len(formation) < formationSize:
+                    card = highest_card(sameSuit)
+                    formation.append(card)
+                    sameSuit ^= CARD_BITS[card]
+                return detect_formation(tuple(formation), special)
 
         if straight:
             for s in possibleStraights:
                 formation = copy.copy(cards)
                 for value in s:
-                    for card in self.cardsLeft['troop']:
-                        if card[0] == value: # Value is available.
-                            formation.append(card)
-                            break
-                    else: # Value is not available.
+                    card = lowest_card(self.poolMask & VALUE_MASKS[value])
+                    if card == None: # Value is not available.
                         break
+                    formation.append(card)
                 else: # All values are available.
                     return detect_formation(tuple(formation), special)
 
@@ -324,81 +661,181 @@ class Round():
             special = ('mud', 'fog')
         else:
             special = ('fog',)
-        cardsLeft = sorted(self.cardsLeft['troop'], reverse=True) # Desc.
-        nEmptySlots = formationSize - len(cards)
-        return detect_formation(tuple(cards + cardsLeft[:nEmptySlots]),
-                                special)
-
-    def best_empty(self, mud=False): ### TODO: Loop through best_case instead?
-        """Find best formation (self.best) still playable at an empty flag."""
+        formation = list(cards)
+        troopsLeft = self.poolMask & TROOP_MASK
+        while len(formation) < formationSize and troopsLeft: # Strongest first
+            card = highest_card(troopsLeft)
+            formation.append(card)
+            troopsLeft ^= CARD_BITS[card]
+        return detect_formation(tuple(formation), special)
+
+    def best_empty(self, mud=False):
+        """Find best formation (self.best) still playable at an empty flag.
+
+        Cards only ever leave the pool, so a straight flush, triple, or
+        straight that is out of reach stays out of reach.  self.emptyCursors
+        remembers how far down each (strongest-first) candidate list the
+        search has already ruled things out.
+        """
         special = ()
-        oldBest = self.best # Exclude better formations from search.
         fSize = FORMATION_SIZE
         if mud:
             special = ('mud',)
-            oldBest = self.bestMud
             fSize += 1
 
-        cardsLeft = sorted(self.cardsLeft['troop'], reverse=True) # Desc.
-        # TODO: does this list always have just one item?
-        for fType in POKER_HIERARCHY[POKER_HIERARCHY.index(oldBest['type']):]:
-            if fType == 'sum':
-                return self.best_case(tuple(cardsLeft[:fSize]), special)
-            
+        troopsLeft = self.poolMask & TROOP_MASK
+        cursors = self.emptyCursors[fSize]
+        for fType in POKER_HIERARCHY:
             if fType == 'flush':
-                bestSoFar = {'strength':0}
-                for card in cardsLeft:                         #     
-                    self.cardsLeft['troop'].remove(card)       # Card can't be
-                    bestCase = self.best_case([card], special) # played twice.
-                    self.cardsLeft['troop'].append(card)       #
-                    if bestCase['type'] == fType:
-                        if bestCase['strength'] > bestSoFar['strength']:
-                            bestSoFar = bestCase
-                if bestSoFar['strength'] > 0:
+                bestSoFar = None
+                for suitMask in SUIT_MASKS.values():
+                    cards = pick_cards(troopsLeft, ((suitMask, fSize),), True)
+                    if cards != None:
+                        formation = detect_formation(cards, special)
+                        if bestSoFar == None or formation > bestSoFar:
+                            bestSoFar = formation
+                if bestSoFar != None:
                     return bestSoFar
 
-            ### TODO: Don't double-check same-valued triples, straights.
-            for card in cardsLeft:
-                bestCase = self.best_case((card,), special)
-                if bestCase['type'] == fType:
-                    return bestCase
+            elif fType == 'sum':
+                cards = pick_cards(troopsLeft, ((TROOP_MASK, fSize),), True)
+                if cards == None: # Too few cards left to fill a flag
+                    return NO_FORMATION
+                return detect_formation(cards, special)
+
+            else:
+                candidates = EMPTY_FLAG_CANDIDATES[fSize][fType]
+                i = cursors[fType]
+                while i < len(candidates):
+                    cards = pick_cards(troopsLeft, candidates[i])
+                    if cards != None:
+                        break
+                    i += 1
+                cursors[fType] = i
+                if i < len(candidates):
+                    return detect_formation(cards, special)
+
+    def resolve_flags(self, justPlayed):
+        """After a play, try to settle flags, then check for a round winner.
+
+        Only dirty flags are tried: those the play touched, and those where
+        the defender's best formation needed the card that just left the
+        pool.  Nothing else about the other flags can have changed.
+        """
+        newWinner = False
+        for i in sorted(self.dirtyFlags):
+            f = self.flags[i]
+            self.try_to_resolve(f)
+            if f.winner != None:
+                self.wonMasks[f.winner] |= 1 << i
+                newWinner = True
+            for p in range(N_PLAYERS): # Room may have opened or closed.
+                if f.slots_left(p) > 0:
+                    self.openMasks[p] |= 1 << i
+                else:
+                    self.openMasks[p] &= ~(1 << i)
+        self.dirtyFlags.clear()
+
+        if newWinner:
+            self.winner = self.check_winner()
+
+    def apply_move(self, play, scoutPlayer=None):
+        """Make a play for the current player (no AI asked), end the turn.
+
+        For search: every call can be taken back with undo_move.  A play of
+        (None, None, None) is a pass.
+        """
+        self.undoStack.append(self.snapshot())
+        card, target, deckName = play
+        if card != None:
+            self.make_play(card, target, deckName, scoutPlayer)
+            self.resolve_flags(card)
+        self.whoseTurn = 1 - self.whoseTurn
+
+    def undo_move(self):
+        """Take back the last apply_move."""
+        self.restore(self.undoStack.pop())
+
+    def snapshot(self):
+        """Return a compact copy of the round state, to pass to restore.
+
+        Only the small mutable lists are copied.  Formations and special
+        tuples are shared, as the engine never modifies them in place.
+        """
+        return (tuple((f.played[0][:], f.played[1][:], f.playedMask[:],
+                       f.best[:], f.special, f.winner) for f in self.flags),
+                tuple((h.cards[:], h.mask) for h in self.h),
+                self.cardsLeft['troop'][:], self.cardsLeft['tactics'][:],
+                self.poolMask,
+                self.decks['troop'][:], self.decks['tactics'][:],
+                self.best, self.bestMud,
+                {size : cursors.copy()
+                 for size, cursors in self.emptyCursors.items()},
+                self.playedLeader, self.tacticsAdvantage, self.winner,
+                self.whoseTurn, tuple(self.wonMasks), tuple(self.openMasks))
+
+    def restore(self, state):
+        """Return the round to a state from snapshot (reusable)."""
+        (flags, hands, troopsLeft, tacticsLeft, self.poolMask, troopDeck,
+         tacticsDeck, self.best, self.bestMud, emptyCursors,
+         self.playedLeader, self.tacticsAdvantage, self.winner,
+         self.whoseTurn, wonMasks, openMasks) = state
+        self.wonMasks, self.openMasks = list(wonMasks), list(openMasks)
+
+        for f, (played0, played1, playedMask, best, special, winner) in \
+                zip(self.flags, flags):
+            f.played = [played0[:], played1[:]]
+            f.playedMask, f.best = playedMask[:], best[:]
+            f.special, f.winner = special, winner
+        for h, (cards, mask) in zip(self.h, hands):
+            h.cards, h.mask = cards[:], mask
+        self.cardsLeft = {'troop':troopsLeft[:], 'tactics':tacticsLeft[:]}
+        self.decks = {'troop':troopDeck[:], 'tactics':tacticsDeck[:]}
+        self.emptyCursors = {size : cursors.copy()
+                             for size, cursors in emptyCursors.items()}
+        self.dirtyFlags = set()
+
+    def try_to_resolve(self, flag):
+        """Determine whether a flag is won, either normally or by proof.
+
+        A proof needs one complete formation (the attacker's) that the other
+        side (the defender) can no longer beat with any troops still
+        unplayed.  Ties go to the attacker, who finished first.
+        """
+        if flag.winner != None:
+            return
 
-    def update_flag(self, flag, justPlayed, forceUpdate=False):
-        """Find the new best continuation at the flag, if necessary."""
         formationSize = FORMATION_SIZE
         if 'mud' in flag.special:
             formationSize += 1
-
-        for p in range(N_PLAYERS):
-            if forceUpdate or (justPlayed in flag.best[p]['cards']) !=\
-                              (justPlayed in flag.played[p]):
-                flag.best[p] = self.best_case(tuple(flag.played[p]),\
-                                              flag.special)
+        finishedPlayers = [p for p in range(N_PLAYERS)
+                           if len(flag.played[p]) == formationSize]
+
+        if len(finishedPlayers) == N_PLAYERS: # Both players ready
+            flag.winner = compare_formations(
+                [detect_formation(tuple(cards), flag.special)
+                 for cards in flag.played],
+                self.whoseTurn)
+        elif len(finishedPlayers) == 1: # One attacker seeks a proof.
+            attacker = finishedPlayers[0]
+            defender = 1 - attacker
+            flag.best[attacker] = detect_formation(
+                tuple(flag.played[attacker]), flag.special)
+            flag.best[defender] = self.best_case(flag.played[defender],
+                                                 flag.special)
+            if flag.best[defender] <= flag.best[attacker]:
+                flag.winner = attacker
 
     def check_winner(self):
         """Check for a majority or breakthrough victory.  Return any winner."""
-        flagOutcomes = [f.winner for f in self.flags]
-
-        for player in range(N_PLAYERS):
-            if flagOutcomes.count(player) >= STANDARD_WIN:
-                return player
-
-        breakthroughStreak = 0
-        streakHolder = None
-        for i in range(N_FLAGS):
-            if flagOutcomes[i] != None:
-                if flagOutcomes[i] == streakHolder:
-                    breakthroughStreak += 1
-                    if breakthroughStreak == BREAKTHROUGH_WIN:
-                        return streakHolder
-                else:
-                    streakHolder = flagOutcomes[i]
-                    breakthroughStreak = 1
-            else:
-                breakthroughStreak = 0
-                streakHolder = None
+        return find_round_winner_by_masks(self.wonMasks)
 
-        return None
+    def claim_wins(self, iFlag, p):
+        """Check whether p would win the round by winning flag iFlag.
+
+        Changes nothing, so it is cheap to ask about every flag.
+        """
+        return wins_round(self.wonMasks[p] | 1 << iFlag)
 
     def show_flags(self):
         """Jankily print the board state."""
@@ -453,17 +890,29 @@ class Round():
         """Track all cards played at one flag.
 
         played (list of 2 list): Troop-like cards played on each side
-        best (list of 2 dict): Best formation still achievable on each side
+        playedMask (list of 2 int): Bitmasks of the same cards
+        best (list of 2 Formation): Best formation achievable on each side,
+                                    as of the last proof attempt
+                                    (Round.try_to_resolve)
         special (list of str): Whether 'fog' or 'mud' is in play here
         winner (int or None): Who won the flag
         """
 
         def __init__(self, initialBest):
             self.played = [[], []]
+            self.playedMask = [0, 0]
             self.best = [initialBest, initialBest]
             self.special = ()
             self.winner = None
 
+        def add_card(self, p, card):
+            self.played[p].append(card)
+            self.playedMask[p] |= CARD_BITS[card]
+
+        def remove_card(self, p, card):
+            self.played[p].remove(card)
+            self.playedMask[p] &= ~CARD_BITS[card]
+
         def has_card(self, p):
             """Check whether the player has played here."""
             return self.winner == None and self.played[p] != []
@@ -478,44 +927,19 @@ class Round():
                 nSlots += 1
             return nSlots - len(self.played[p])
 
-        def try_to_resolve(self, whoseTurn):
-            """Determine whether a flag is won, either normally or by proof."""
-            if self.winner == None:
-                formationSize = FORMATION_SIZE
-                if 'mud' in self.special:
-                    formationSize += 1
-    
-                formations = [tuple(l) for l in self.played]
-                finishedPlayers = [p for p in range(N_PLAYERS)
-                                   if len(formations[p]) == formationSize]
-                
-                if len(finishedPlayers) == N_PLAYERS: # Both players ready 
-                    self.winner = compare_formations(
-                        [detect_formation(f, self.special)
-                         for f in formations],
-                        whoseTurn)
-                elif len(finishedPlayers) == 1: # One attacker seeks a proof.
-                    for p in range(N_PLAYERS):
-                        if p not in finishedPlayers: # Defender
-                            formations[p] = copy.copy(self.best[p])
-                            # Tie goes to attacker since he finished first.
-                            formations[p]['strength'] -= EPSILON
-                            formations[1-p] = self.best[1-p]
-                            if compare_formations(formations, whoseTurn)\
-                                    == 1-p:
-                                self.winner = 1-p # Attacker wins.
-
 
     class Hand():
         """Manage one player's hand of cards.
 
         cards (list of str): One str per card (e.g., '2r' is a red two)
+        mask (int): Bitmask of the same cards
         seat (int): Player ID number (starting player is 0, other player is 1)
         name (str): Player name to show in output
         """
 
         def __init__(self, seat, name):
             self.cards = []
+            self.mask = 0
             self.seat = seat
             self.name = name
 
@@ -526,6 +950,8 @@ class Round():
 
         def add(self, newCard):
             self.cards.append(newCard)
+            self.mask |= CARD_BITS[newCard]
 
         def drop(self, card):
             self.cards.remove(card)
+            self.mask &= ~CARD_BITS[card]
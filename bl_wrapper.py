@@ -2,78 +2,206 @@
 """Wrapper for playing more than one round of Battle Line."""
 
 import sys, argparse, logging, random, math
-from play_bl import play_one_round
-from bl_classes import Player
-from players import *
-
-availablePlayers = {}
-for playerSubClass in Player.__subclasses__():
-    availablePlayers[playerSubClass.get_name()] = playerSubClass
-    # Sniper Player inherits Naive Player, not vanilla Player.
-    for playerSubSubClass in playerSubClass.__subclasses__():
-        availablePlayers[playerSubSubClass.get_name()] = playerSubSubClass
-
-# Parse command-line args.
-parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('declaredPlayers', metavar='player', type=str, nargs=2,
-    help=', '.join(availablePlayers.keys()))
-parser.add_argument('-n', '--n_rounds', default=1, metavar='n_rounds',
-    type=int, help='positive int')
-
-args = parser.parse_args()
-
-assert args.n_rounds > 0
-verbose = True
-if args.n_rounds > 1:
-    verbose = False
-
-# Load players.
-players = []
-rawNames = args.declaredPlayers
-for i in range(len(rawNames)):
-    assert rawNames[i] in availablePlayers
-    players.append(availablePlayers[rawNames[i]](i))
-    rawNames[i] = rawNames[i].capitalize()
-
-# Resolve duplicate names by appending '1', '2', etc. as needed.
-names = []
-counters = {name : 0 for name in rawNames}
-for name in rawNames:
-    if rawNames.count(name) > 1:
-        counters[name] += 1
-        names.append(name + str(counters[name]))
-    else:
-        names.append(name)
-
-# Pad names for better verbose display.
-longestName = ''
-for name in names:
-    if len(name) > len(longestName):
-        longestName = name
-for i in range(len(names)):
-    while len(names[i]) < len(longestName):
-        names[i] += ' '
-
-# Play rounds.
-winners = []
-for i in range(args.n_rounds):
-    if verbose:
-        print('\nROUND {}:'.format(i))
-    winners.append(play_one_round(players, names, verbose))
+from tournament import availablePlayers, play_rounds, make_player_sets, \
+                       play_tournament_round, win_rate
+from league import play_league, elo_ratings
+from instrumentation import Timings
+from play_bl import winner_name
+from bl_classes import TimeControl, set_cache_size, prewarm_caches
+
+def main():
+    # Parse command-line args.
+    parser = argparse.ArgumentParser(description='Process some integers.')
+    parser.add_argument('declaredPlayers', metavar='player', type=str,
+        nargs='+', help=', '.join(availablePlayers.keys()) + ', or all (more '
+                        'than two players play a league)')
+    parser.add_argument('-n', '--n_rounds', default=1, metavar='n_rounds',
+        type=int, help='positive int (per pairing, in a league)')
+    parser.add_argument('-w', '--workers', default=1, metavar='workers',
+        type=int, help='number of processes to spread rounds over (not '
+                       'MCTS search; see MCTSPlayer.workers)')
+    parser.add_argument('-s', '--seed', default=None, metavar='seed',
+        type=int, help='tournament seed (random if omitted)')
+    parser.add_argument('--replay_round', default=None, metavar='i',
+        type=int, help='replay just round i of the tournament with this seed '
+                       '(verbose)')
+    parser.add_argument('-t', '--timings', action='store_true',
+        help='print time per move and per engine phase')
+    parser.add_argument('-p', '--profile', default=None, metavar='dir',
+        help='also profile each bot into dir/<bot>.prof (one process)')
+    parser.add_argument('-m', '--move_time', default=None, metavar='seconds',
+        type=float, help='time limit per move')
+    parser.add_argument('-g', '--game_time', default=None, metavar='seconds',
+        type=float, help='time limit for all of a player\'s moves in a round')
+    parser.add_argument('-f', '--forfeit', action='store_true',
+        help='running out of time loses the round (default: a default move '
+             'is played)')
+    parser.add_argument('-d', '--duplicate', action='store_true',
+        help='play each deal twice, swapping seats (in a league, all '
+             'pairings also share deals)')
+    parser.add_argument('-r', '--record', default=None, metavar='path',
+        help='append a record of every round to path (see game_record)')
+    parser.add_argument('-e', '--precision', default=None, metavar='e',
+        type=float, help='in a league, stop a pairing early once its score '
+                         'is within e (or clearly decided)')
+    parser.add_argument('-c', '--cache_size', default=None, metavar='size',
+        type=int, help='results kept by each formation cache')
+    parser.add_argument('--prewarm', action='store_true',
+        help='fill the formation caches before play (shared by workers)')
+
+    args = parser.parse_args()
+
+    assert args.n_rounds > 0
+    assert args.workers > 0
+    assert not args.duplicate or args.n_rounds % 2 == 0 or \
+           args.replay_round != None # Whole deals (unless replaying one)
+    verbose = True
+    if args.n_rounds > 1:
+        verbose = False
+
+    workers = min(args.workers, args.n_rounds)
+    timings = None
+    if args.timings or args.profile:
+        timings = Timings(args.profile != None)
+    if args.profile: # Profiles can't be gathered from other processes.
+        workers = 1
+
+    timeControl = None
+    if args.move_time != None or args.game_time != None:
+        timeControl = TimeControl(args.move_time, args.game_time,
+                                  args.forfeit)
+
+    if args.cache_size != None: # Before any workers are forked
+        set_cache_size(args.cache_size)
+    if args.prewarm:
+        prewarm_caches()
+
+    seed = args.seed
+    if seed == None:
+        seed = random.randrange(2**32)
+
+    # Check players.
+    rawNames = args.declaredPlayers
+    if rawNames == ['all']:
+        rawNames = sorted(availablePlayers)
+    for i in range(len(rawNames)):
+        assert rawNames[i] in availablePlayers
+
+    if len(rawNames) != 2:
+        assert len(set(rawNames)) == len(rawNames) > 2
+        assert timings == None # Only for two players
+        record = None
+        if args.record:
+            record = open(args.record, 'a')
+        play_league_and_report(rawNames, args.n_rounds, seed, args.workers,
+                               args.precision, timeControl, args.duplicate,
+                               record)
+        if record != None:
+            record.close()
+        return
+    playerNames = rawNames[:]
+    rawNames = [name.capitalize() for name in rawNames]
+
+    # Resolve duplicate names by appending '1', '2', etc. as needed.
+    names = []
+    counters = {name : 0 for name in rawNames}
+    for name in rawNames:
+        if rawNames.count(name) > 1:
+            counters[name] += 1
+            names.append(name + str(counters[name]))
+        else:
+            names.append(name)
+
+    # Pad names for better verbose display.
+    longestName = ''
+    for name in names:
+        if len(name) > len(longestName):
+            longestName = name
+    for i in range(len(names)):
+        while len(names[i]) < len(longestName):
+            names[i] += ' '
+
+    if args.replay_round != None: # Same seed and index, same round
+        assert args.seed != None
+        result = play_tournament_round(
+            make_player_sets(playerNames, args.duplicate), names, True, seed,
+            args.replay_round, args.duplicate, timeControl)
+        print('Winner: {}'.format(winner_name(result, names)))
+        return
+
+    # Play rounds.
+    record = None
+    if args.record:
+        record = open(args.record, 'a')
+    winners = []
+    scores = [] # First player's
+    overruns = [0] * len(names)
+    for result in play_rounds(playerNames, names, args.n_rounds, seed,
+                              verbose, workers, timings, timeControl,
+                              record, args.duplicate):
+        winners.append(winner_name(result, names))
+        scores.append(0.5 if result.winner == None else 1 - result.winner)
+        overruns = [n + m for n, m in zip(overruns, result.overruns)]
+        if not verbose:
+            print('Winner: {}'.format(winners[-1]))
+
+    if record != None:
+        record.close()
+
+    # Print average scores.
     if not verbose:
-        print('Winner: {}'.format(winners[-1]))
+        print('')
+    if len(winners) > 1 and args.duplicate: # Stats of paired outcomes
+        ratio, stdErr = win_rate(scores, True)
+        name = names[0]
+        if ratio < 0.5:
+            ratio, name = 1 - ratio, names[1]
+        print('{0} wins {1:.3f} +/- {2:.3f}'.format(name, ratio, stdErr))
+        print('Seed: {}'.format(seed))
+
+    elif len(winners) > 1: # Print stats only if there were multiple rounds.
+        nDraws = args.n_rounds - sum([winners.count(n) for n in names])
+        for name in names:
+            ratio = (winners.count(name) + 0.5 * nDraws) / args.n_rounds
+            stdErr = math.sqrt(ratio * (1 - ratio) / args.n_rounds)
+            if ratio >= 0.5:
+                print('{0} wins {1:.3f} +/- {2:.3f}'.format(name, ratio,
+                                                            stdErr))
+                break
+        print('Seed: {}'.format(seed))
+
+    elif verbose: # Still print score for silent single round.
+        print('Winner: {}'.format(winners[0]))
+
+    if timeControl != None:
+        for name, n in zip(names, overruns):
+            print('{} ran out of time {} times'.format(name.strip(), n))
+
+    if timings != None:
+        print('')
+        print('\n'.join(timings.report()))
+    if args.profile:
+        timings.dump_profiles(args.profile)
+
+def play_league_and_report(playerNames, nRounds, seed, workers, precision,
+                           timeControl, duplicate, record=None):
+    """Play a league, print pairings as they finish, then print ratings."""
+    pairings = []
+    for pairing, result in play_league(playerNames, nRounds, seed, workers,
+                                       precision, timeControl=timeControl,
+                                       duplicate=duplicate, record=record):
+        if pairing.done and pairing.rounds == pairing.scheduled:
+            pairings.append(pairing)
+            print('{} vs {}: {:.3f} +/- {:.3f} after {} rounds'.format(
+                  *pairing.names, pairing.rate(), pairing.half_width(1),
+                  pairing.rounds))
 
-# Print average scores.
-if not verbose:
     print('')
-if len(winners) > 1: # Print stats only if there were multiple rounds.
-    nDraws = args.n_rounds - sum([winners.count(n) for n in names])
-    for name in names:
-        ratio = (winners.count(name) + 0.5 * nDraws) / args.n_rounds
-        stdErr = math.sqrt(ratio * (1 - ratio) / args.n_rounds)
-        if ratio >= 0.5:
-            print('{0} wins {1:.3f} +/- {2:.3f}'.format(name, ratio, stdErr))
-            break
- 
-elif verbose: # Still print score for silent single round.
-    print('Winner: {}'.format(winners[0]))
+    ratings = elo_ratings(pairings)
+    for name in sorted(ratings, key=lambda name: -ratings[name][0]):
+        print('{:10} {:6.0f}  ({:.0f} to {:.0f})'.format(name,
+                                                          *ratings[name]))
+    print('Seed: {}'.format(seed))
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ will use it, however, then it doesn't belong here."""
 
 from bl_classes import * # Need a package?  Import it in bl_classes.py.
 
-@functools.lru_cache(maxsize=None)
+CACHE_SIZE = 2**16 # Results kept by each cached function (see set_cache_size)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def possible_straights(cards, formationSize=FORMATION_SIZE):
     """Return a seq of conceivable straight continuations."""
     minVal, maxVal = int(TROOP_CONTENTS[0]), int(TROOP_CONTENTS[-1])
@@ -23,11 +25,11 @@ def possible_straights(cards, formationSize=FORMATION_SIZE):
             possibleStraight = list(straight)
             for value in set(cardValues): # Skip already played cards.
                 possibleStraight.remove(value)
-            out.append(list(map(str, possibleStraight)))
+            out.append(tuple(map(str, possibleStraight)))
 
-    return list(reversed(out)) # Strongest first
+    return tuple(reversed(out)) # Strongest first
 
-@functools.lru_cache(maxsize=None)
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def check_formation_components(cards, formationSize=FORMATION_SIZE):
     """Return whether the cards are on track for a straight/triple/flush."""
     straight, triple, flush = False, False, False
@@ -63,66 +65,516 @@ def card_options(card):
         return [card] # Not a wild tactics card
     return [str(n) + suit for n in numbers for suit in TROOP_SUITS]
 
-@functools.lru_cache(maxsize=None)
-def detect_formation(cards, special=()):
-    """Return the strongest formation a complete set of cards achieves.
-    
-    A formation is stored in a dict keyed as follows.
-      'cards' (list): Cards that make up the formation
-      'type' (str): 'straight flush', 'triple', 'flush', 'straight', or 'sum'
-      'strength' (float): Three-digit int, where hundreds place indicates type
-                          and remaining digits indicate sum of card values;
-                          can be adjusted by EPSILON (float) to break a tie.
+class Formation(collections.namedtuple('Formation',
+                                       ['cards', 'type', 'strength', 'rank'])):
+    """A formation (immutable, so cached ones can be shared).
+
+    cards (tuple): Cards that make up the formation
+    type (str): 'straight flush', 'triple', 'flush', 'straight', or 'sum'
+    strength (int): Three-digit int, where hundreds place indicates type and
+                    remaining digits indicate sum of card values
+    rank (int): Index of type in STRENGTH_TYPES (higher is stronger)
+
+    Formations order by strength alone, so 'a > b' means a beats b outright
+    (but == still compares every field).
     """
+    __slots__ = ()
+
+    def __new__(cls, cards, strength):
+        rank = max(strength, 0) // 100
+        return super().__new__(cls, cards, STRENGTH_TYPES[rank], strength,
+                               rank)
+
+    def __getnewargs__(self): # For copy and pickle
+        return self.cards, self.strength
+
+    def __lt__(self, other):
+        return self.strength < other.strength
+
+    def __le__(self, other):
+        return self.strength <= other.strength
+
+    def __gt__(self, other):
+        return self.strength > other.strength
+
+    def __ge__(self, other):
+        return self.strength >= other.strength
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def detect_formation(cards, special=()):
+    """Return the strongest Formation a complete set of cards achieves."""
     l = len(cards)
     assert FORMATION_SIZE <= l <= FORMATION_SIZE + 1 # Allow for Mud.
 
-    cardOptions = list(itertools.product(*[card_options(c) for c in cards]))
-    if len(cardOptions) == 1:
+    if TACTICS.keys().isdisjoint(cards):
         return detect_formation_no_wilds(tuple(cards), tuple(special))
-    else:
-        formations = [detect_formation_no_wilds(tuple(c), tuple(special))
-                      for c in cardOptions]
-        bestFormation = formations[0]
-        for formation in formations[1:]:
-            if compare_formations([formation, bestFormation], 0) == 0:
-                bestFormation = formation
-        return bestFormation
-
-@functools.lru_cache(maxsize=None)
+    return best_wild_formation(tuple(cards), tuple(special)) # Nothing to add
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def detect_formation_no_wilds(cards, special=()):
     """Same as detect_formation, but assumes no wild tactics present."""
-    straight, triple, flush = check_formation_components(cards, len(cards))
-
+    strength = formation_strength(cards)
     if 'fog' in special:
-        fType = 'sum'
-    elif straight and flush:
-        fType = 'straight flush'
-    elif triple:
-        fType = 'triple'
-    elif flush:
-        fType = 'flush'
-    elif straight:
-        fType = 'straight'
-    else:
-        fType = 'sum'
+        strength %= 100 # Sum of card values only
 
-    formationTypeStrength = 100 * POKER_HIERARCHY[::-1].index(fType)
-    sumOfCardValues = sum([int(c[0]) for c in cards]) 
+    return Formation(cards, strength)
+
+def formation_strength(cards):
+    """Look up the strength of a complete set of non-wild cards."""
+    key, flush, firstSuit = 0, 1, cards[0][1]
+    for card in cards:
+        key = 10 * key + CARD_CODES[card] // N_SUITS
+        if card[1] != firstSuit:
+            flush = 0
+    return FORMATION_TABLES[len(cards)][2 * key + flush]
+
+def build_formation_table(formationSize):
+    """Tabulate the strength of every complete formation of a given size.
+
+    Formation type depends only on the card values and on whether the suits
+    match, so the table is indexed by the values read as a base-10 number (in
+    play order, so no sorting is needed), times two, plus one for a flush.
+    """
+    table = array.array('H', [0] * (2 * 10**formationSize))
+    for values in itertools.product(range(N_VALUES), repeat=formationSize):
+        key = 0
+        for value in values:
+            key = 10 * key + value
+
+        spread = max(values) - min(values)
+        triple = spread == 0
+        straight = len(set(values)) == formationSize and \
+                   spread == formationSize - 1
+        for flush in (0, 1):
+            if straight and flush:
+                fType = 'straight flush'
+            elif triple:
+                fType = 'triple'
+            elif flush:
+                fType = 'flush'
+            elif straight:
+                fType = 'straight'
+            else:
+                fType = 'sum'
+            table[2 * key + flush] = 100 * STRENGTH_TYPES.index(fType) + \
+                                     sum(values)
+    return table
+
+# Troop cards are encoded as ints: value * N_SUITS + suit (0-59).  Tactics
+# cards follow (60-69).  A set of cards is a bitmask with bit CARD_CODES[card].
+N_VALUES, N_SUITS = len(TROOP_CONTENTS), len(TROOP_SUITS)
+CARD_CODES = {v + s : i * N_SUITS + j for i, v in enumerate(TROOP_CONTENTS)
+                                      for j, s in enumerate(TROOP_SUITS)}
+CARD_CODES.update({card : N_VALUES * N_SUITS + i
+                   for i, card in enumerate(TACTICS)})
+CARD_NAMES = sorted(CARD_CODES, key=CARD_CODES.get) # Indexed by code
+CARD_BITS = {card : 1 << code for card, code in CARD_CODES.items()}
+TROOP_MASK = (1 << N_VALUES * N_SUITS) - 1
+TACTICS_MASK = ((1 << len(CARD_CODES)) - 1) ^ TROOP_MASK
+VALUE_MASKS = {v : sum(CARD_BITS[v + s] for s in TROOP_SUITS)
+               for v in TROOP_CONTENTS}
+SUIT_MASKS = {s : sum(CARD_BITS[v + s] for v in TROOP_CONTENTS)
+              for s in TROOP_SUITS}
+STRENGTH_TYPES = POKER_HIERARCHY[::-1] # Indexed by strength // 100
+NO_FORMATION = Formation((), -1) # Too few troops left to fill a flag
+FORMATION_TABLES = {size : build_formation_table(size) # Allow for Mud.
+                    for size in (FORMATION_SIZE, FORMATION_SIZE + 1)}
+
+def cards_to_mask(cards):
+    """Return the bitmask of a group of cards."""
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card]
+    return mask
+
+def mask_to_cards(mask):
+    """Return the cards in a bitmask, highest code (strongest troop) first."""
+    cards = []
+    while mask:
+        code = mask.bit_length() - 1
+        cards.append(CARD_NAMES[code])
+        mask ^= 1 << code
+    return cards
+
+def lowest_card(mask):
+    """Return the card with the lowest code in a bitmask (or None)."""
+    if mask:
+        return CARD_NAMES[(mask & -mask).bit_length() - 1]
+
+def highest_card(mask):
+    """Return the card with the highest code in a bitmask (or None)."""
+    if mask:
+        return CARD_NAMES[mask.bit_length() - 1]
+
+def pick_cards(pool, requirements, strongest=False):
+    """Choose cards from a bitmask pool to satisfy a candidate's requirements.
+
+    Each requirement is a (mask, count) pair: 'count' cards must come from
+    'mask'.  Returns a tuple of cards, or None if the pool falls short.  Takes
+    the lowest codes by default, or the highest (strongest) if requested.
+    """
+    cards = []
+    for mask, count in requirements:
+        available = pool & mask
+        if bin(available).count('1') < count:
+            return None
+        for i in range(count):
+            if strongest:
+                card = highest_card(available)
+            else:
+                card = lowest_card(available)
+            cards.append(card)
+            available ^= CARD_BITS[card]
+    return tuple(cards)
+
+def empty_flag_candidates(formationSize):
+    """List straight flushes, triples, and straights for an empty flag.
+
+    Each type maps to a list of requirements for pick_cards, strongest first.
+    """
+    runs = [range(top, top - formationSize, -1) # Highest top value first
+            for top in range(N_VALUES - 1, formationSize - 2, -1)]
+    return {
+        'straight flush':[tuple((CARD_BITS[TROOP_CONTENTS[v] + s], 1)
+                                for v in run)
+                          for run in runs for s in TROOP_SUITS],
+        'triple':[((VALUE_MASKS[v], formationSize),)
+                  for v in TROOP_CONTENTS[::-1]],
+        'straight':[tuple((VALUE_MASKS[TROOP_CONTENTS[v]], 1) for v in run)
+                    for run in runs]}
 
-    return {'cards':cards,
-            'type':fType,
-            'strength':formationTypeStrength + sumOfCardValues}
+EMPTY_FLAG_CANDIDATES = {size : empty_flag_candidates(size) # Allow for Mud.
+                         for size in (FORMATION_SIZE, FORMATION_SIZE + 1)}
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def summarize_group(cards, special=()):
+    """Reduce a group of non-wild cards to what group_strength needs.
+
+    Returns (values, firstValue, suit, flush, total, nCards, size, fog), where
+    'values' is a bitmask of card values, 'suit' is the first card's, and
+    'size' is the formation size at this flag.
+    """
+    values, total, flush = 0, 0, True
+    for card in cards:
+        value = CARD_CODES[card] // N_SUITS
+        values |= 1 << value
+        total += value
+        flush = flush and card[1] == cards[0][1]
+    firstValue, suit = divmod(CARD_CODES[cards[0]], N_SUITS)
+    size = FORMATION_SIZE + ('mud' in special)
+    return (values, firstValue, suit, flush, total, len(cards), size,
+            'fog' in special)
+
+def group_strength(group, pool):
+    """Strength of the best formation a group can reach (see best_case_batch).
+
+    group (tuple): From summarize_group
+    pool (dict): From Round.pool_summary
+    """
+    values, firstValue, suit, flush, total, nCards, size, fog = group
+    nMissing = size - nCards
+    if fog:
+        return total + pool['allTops'][nMissing]
+
+    distinct = POPCOUNTS[values] == nCards
+    if distinct and flush:
+        suitValues = pool['suitValues'][suit]
+        for run, runSum in RUNS[size]: # Strongest first
+            if values & ~run == 0 and run & ~values & ~suitValues == 0:
+                return 400 + runSum # Straight flush
+
+    if POPCOUNTS[values] == 1 and pool['valueCounts'][firstValue] >= nMissing:
+        return 300 + size * firstValue # Triple
+
+    if flush and POPCOUNTS[pool['suitValues'][suit]] >= nMissing:
+        return 200 + total + pool['suitTops'][suit][nMissing]
+
+    if distinct:
+        availableValues = pool['availableValues']
+        for run, runSum in RUNS[size]:
+            if values & ~run == 0 and run & ~values & ~availableValues == 0:
+                return 100 + runSum # Straight
+
+    return total + pool['allTops'][nMissing] # Sum
+
+def batch_strengths_numpy(groups, pool):
+    """Vectorized group_strength over many groups at once."""
+    np = numpy
+    values, firstValue, suit, flush, total, nCards, size, fog = map(
+        np.array, zip(*groups))
+    suitValues = np.array(pool['suitValues'])
+    suitTops, allTops = np.array(pool['suitTops']), np.array(pool['allTops'])
+    popcounts = np.array(POPCOUNTS)
+    nMissing = size - nCards
+    distinct = popcounts[values] == nCards
+
+    # Score every type, then keep the strongest achievable.
+    best = total + allTops[nMissing] # Sum
+    triple = (popcounts[values] == 1) & \
+             (np.array(pool['valueCounts'])[firstValue] >= nMissing)
+    best = np.where(triple, 300 + size * firstValue, best)
+    suitFlush = flush & (popcounts[suitValues[suit]] >= nMissing)
+    best = np.maximum(best, np.where(
+        suitFlush, 200 + total + suitTops[suit, nMissing], -1))
+
+    for fSize, runList in RUNS.items():
+        runs = np.array([run for run, runSum in runList])[None, :]
+        runSums = np.array([runSum for run, runSum in runList])[None, :]
+        contained = (size == fSize)[:, None] & distinct[:, None] & \
+                    ((values[:, None] & ~runs) == 0)
+        missing = runs & ~values[:, None]
+        straight = contained & ((missing & ~pool['availableValues']) == 0)
+        straightFlush = contained & flush[:, None] & \
+                        ((missing & ~suitValues[suit][:, None]) == 0)
+        best = np.maximum(best, np.where(straight, 100 + runSums,
+                                         -1).max(axis=1))
+        best = np.maximum(best, np.where(straightFlush, 400 + runSums,
+                                         -1).max(axis=1))
+
+    best = np.where(fog, total + allTops[nMissing], best)
+    return best.tolist()
+
+# Value masks and sums of every straight, strongest first, by size
+RUNS = {size : [(sum(1 << v for v in range(low, low + size)),
+                 sum(range(low, low + size)))
+                for low in range(N_VALUES - size, -1, -1)]
+        for size in (FORMATION_SIZE, FORMATION_SIZE + 1)} # Allow for Mud.
+POPCOUNTS = [bin(i).count('1') for i in range(2**N_VALUES)] # Of value masks
+NUMPY_MIN_BATCH = 256 # Smallest batch worth sending through NumPy
+WILD_VALUES = {card : sorted(set(CARD_CODES[c] // N_SUITS
+                                 for c in card_options(card)))
+               for card in TACTICS if card_options(card) != [card]}
+
+def best_wild_formation(cards, special=(), pool=0):
+    """Return the best Formation a group with wild tactics can reach.
+
+    cards (tuple): Cards played, at least one of them wild (see WILD_VALUES)
+    pool (int): Bitmask of the troops left to complete the group with
+
+    Rather than trying every card each wild could stand for, tries the
+    formation types strongest first, and the strongest targets within each
+    type first, so the first target that the wilds and the pool can
+    complete is the answer.  Each wild appears in the formation's cards as
+    the troop it stands for (see detect_formation).  Not cached: the pool
+    changes between nearly all calls.
+    """
+    size = FORMATION_SIZE + ('mud' in special)
+    nMissing = size - len(cards)
+    troops = [c for c in cards if c not in TACTICS]
+    wilds = [WILD_VALUES[c] for c in cards if c in TACTICS]
+    values = [CARD_CODES[c] // N_SUITS for c in troops]
+    valueMask = sum(1 << v for v in set(values))
+    suits = set(c[1] for c in troops)
+    suitOptions = suits or TROOP_SUITS
+    distinct = len(set(values)) == len(values)
+    sameSuit = len(suits) <= 1
+    formation = None
+
+    if 'fog' not in special:
+        if distinct and sameSuit: # Straight flush
+            for run, runSum in RUNS[size]:
+                if valueMask & ~run == 0:
+                    formation = fill_run(troops, wilds, run & ~valueMask,
+                                         pool, suitOptions)
+                    if formation != None:
+                        break
+
+        if formation == None and len(set(values)) <= 1: # Triple
+            for v in values[:1] or range(N_VALUES - 1, -1, -1):
+                if all(v in w for w in wilds) and POPCOUNTS[
+                        value_suits(pool, v)] >= nMissing:
+                    formation = troops + [TROOP_CONTENTS[v] + TROOP_SUITS[0]
+                                          for w in wilds] + list(pick_cards(
+                        pool, ((VALUE_MASKS[TROOP_CONTENTS[v]], nMissing),)))
+                    break
+
+        if formation == None and sameSuit: # Flush
+            bestTotal = -1
+            for suit in suitOptions:
+                picked = pick_cards(pool, ((SUIT_MASKS[suit], nMissing),),
+                                    True)
+                if picked != None:
+                    total = sum(CARD_CODES[c] // N_SUITS for c in picked)
+                    if total > bestTotal:
+                        bestTotal = total
+                        formation = troops + [TROOP_CONTENTS[max(w)] + suit
+                                              for w in wilds] + list(picked)
+
+        if formation == None and distinct: # Straight
+            for run, runSum in RUNS[size]:
+                if valueMask & ~run == 0:
+                    formation = fill_run(troops, wilds, run & ~valueMask,
+                                         pool, None)
+                    if formation != None:
+                        break
+
+    if formation == None: # Sum
+        picked = pick_cards(pool & TROOP_MASK, ((TROOP_MASK, nMissing),),
+                            True)
+        if picked == None: # Too few troops left
+            picked = tuple(mask_to_cards(pool & TROOP_MASK))
+        formation = troops + [TROOP_CONTENTS[max(w)] + TROOP_SUITS[0]
+                              for w in wilds] + list(picked)
+    return detect_formation_no_wilds(tuple(formation), tuple(special))
+
+def value_suits(pool, value):
+    """Return a bitmask of the suits left in the pool for a value."""
+    return (pool >> (value * N_SUITS)) & ((1 << N_SUITS) - 1)
+
+def fill_run(troops, wilds, missing, pool, suitOptions):
+    """Complete a run with wilds and pool cards.  Return the cards or None.
+
+    missing (int): Value mask of the run's values not yet played
+    suitOptions (seq or None): Suits for a straight flush (None: straight)
+    """
+    missingValues = [v for v in range(N_VALUES) if missing >> v & 1]
+    for wildValues in itertools.permutations(missingValues, len(wilds)):
+        if not all(v in w for v, w in zip(wildValues, wilds)):
+            continue
+        poolValues = [v for v in missingValues if v not in wildValues]
+        for suit in suitOptions or (None,):
+            cards = [TROOP_CONTENTS[v] + (suit or TROOP_SUITS[0])
+                     for v in wildValues]
+            for v in poolValues:
+                mask = VALUE_MASKS[TROOP_CONTENTS[v]]
+                if suit != None:
+                    mask &= SUIT_MASKS[suit]
+                card = lowest_card(pool & mask)
+                if card == None:
+                    break
+                cards.append(card)
+            else:
+                return troops + cards
+    return None
+
+CACHED_FUNCTIONS = ('possible_straights', 'check_formation_components',
+                    'detect_formation', 'detect_formation_no_wilds',
+                    'summarize_group')
+CacheStats = collections.namedtuple('CacheStats',
+                                    ['hits', 'misses', 'evictions', 'size',
+                                     'maxsize'])
+
+def cache_stats():
+    """Return the CacheStats of each cache in this process (dict).
+
+    Evictions are inferred: every miss stores a result, so whatever isn't
+    still stored was evicted.
+    """
+    stats = {}
+    for name in CACHED_FUNCTIONS:
+        info = globals()[name].cache_info()
+        stats[name] = CacheStats(info.hits, info.misses,
+                                 info.misses - info.currsize, info.currsize,
+                                 info.maxsize)
+    stats['ESTIMATE_CACHE'] = CacheStats(ESTIMATE_CACHE_STATS['hits'],
+                                         ESTIMATE_CACHE_STATS['misses'],
+                                         ESTIMATE_CACHE_STATS['evictions'],
+                                         len(ESTIMATE_CACHE),
+                                         ESTIMATE_CACHE_SIZE)
+    return stats
+
+def clear_caches():
+    """Empty every cache and zero its counters."""
+    for name in CACHED_FUNCTIONS:
+        globals()[name].cache_clear()
+    ESTIMATE_CACHE.clear()
+    ESTIMATE_CACHE_STATS.clear()
+
+def set_cache_size(maxsize):
+    """Rebuild every cache to hold at most maxsize results (None: no limit).
+
+    Modules that imported the caches (e.g., with import *) are pointed at
+    the new ones too.  Empties the caches, so call it early.
+    """
+    clear_caches()
+    olds = {name : globals()[name] for name in CACHED_FUNCTIONS}
+    news = {name : functools.lru_cache(maxsize=maxsize)(old.__wrapped__)
+            for name, old in olds.items()}
+    for module in list(sys.modules.values()):
+        if getattr(module, 'set_cache_size', None) is set_cache_size:
+            module.CACHE_SIZE = maxsize
+        for name in CACHED_FUNCTIONS:
+            if getattr(module, name, None) is olds[name]:
+                setattr(module, name, news[name])
+
+def prewarm_caches():
+    """Fill the caches for partial groups (one or two troops per side).
+
+    These are asked about on every turn, so a long-lived process can pay
+    for them once, up front.  Return the number of results cached.
+    """
+    troops = [v + s for v in TROOP_CONTENTS for s in TROOP_SUITS]
+    groups = [(c,) for c in troops] + list(itertools.permutations(troops, 2))
+    for size in (FORMATION_SIZE, FORMATION_SIZE + 1): # Allow for Mud.
+        for group in groups:
+            possible_straights(group, size)
+            check_formation_components(group, size)
+    return sum(globals()[name].cache_info().currsize
+               for name in CACHED_FUNCTIONS)
 
 def compare_formations(formations, whoseTurn):
     """Return the player whose formation is stronger.  Account for ties."""
-    ranks = [POKER_HIERARCHY.index(f['type']) for f in formations]
-    strengths = [f['strength'] for f in formations]
-    if strengths[0] != strengths[1]:
-        return strengths.index(max(strengths))
-    else: # Identical formations, but current player finished 2nd
+    if formations[0].strength != formations[1].strength:
+        return int(formations[1] > formations[0])
+    else: # Equally strong formations, but current player finished 2nd
         return 1 - whoseTurn
 
+def find_round_winner(flagOutcomes):
+    """Return who has a majority or breakthrough, given each flag's winner."""
+    for player in range(N_PLAYERS):
+        if flagOutcomes.count(player) >= STANDARD_WIN:
+            return player
+
+    breakthroughStreak = 0
+    streakHolder = None
+    for i in range(N_FLAGS):
+        if flagOutcomes[i] != None:
+            if flagOutcomes[i] == streakHolder:
+                breakthroughStreak += 1
+                if breakthroughStreak == BREAKTHROUGH_WIN:
+                    return streakHolder
+            else:
+                streakHolder = flagOutcomes[i]
+                breakthroughStreak = 1
+        else:
+            breakthroughStreak = 0
+            streakHolder = None
+
+    return None
+
+def breakthrough_end(wonMask):
+    """Return the flag ending the first breakthrough in a bitmask of flags
+    won by one player (or N_FLAGS, if there is none)."""
+    streak = 0
+    for i in range(N_FLAGS):
+        streak = streak + 1 if wonMask >> i & 1 else 0
+        if streak == BREAKTHROUGH_WIN:
+            return i
+    return N_FLAGS
+
+# Whether each bitmask of flags won is a majority, and where its first
+# breakthrough ends
+MAJORITIES = [bin(m).count('1') >= STANDARD_WIN for m in range(2**N_FLAGS)]
+BREAKTHROUGHS = [breakthrough_end(m) for m in range(2**N_FLAGS)]
+OPEN_FLAGS = [tuple(i for i in range(N_FLAGS) if m >> i & 1) # Flags in a mask
+              for m in range(2**N_FLAGS)]
+
+def wins_round(wonMask):
+    """Return whether a bitmask of one player's flags wins the round."""
+    return MAJORITIES[wonMask] or BREAKTHROUGHS[wonMask] < N_FLAGS
+
+def find_round_winner_by_masks(wonMasks):
+    """Same as find_round_winner, given each player's bitmask of flags won
+    (see Round.wonMasks)."""
+    for player in range(N_PLAYERS):
+        if MAJORITIES[wonMasks[player]]:
+            return player
+
+    ends = [BREAKTHROUGHS[mask] for mask in wonMasks]
+    if min(ends) < N_FLAGS:
+        return ends.index(min(ends))
+    return None
+
 def is_playable(r, tacticsCard):
     """Return whether the current player can play this tactics card.
 
@@ -139,23 +591,19 @@ def is_playable(r, tacticsCard):
             return False
 
     me = r.whoseTurn
-    myEmpty = [i for i, f in enumerate(r.flags) if f.slots_left(me) > 0]
     if tacticsCard in ('Al', 'Da', 'Sh', 'Co'):
-        return myEmpty != []
+        return r.openMasks[me] != 0
 
-    yourFull = [i for i, f in enumerate(r.flags) if f.has_card(1-me)]
     if tacticsCard == 'De':
-        return yourFull != []
+        return any(f.has_card(1-me) for f in r.flags)
 
-    yourFullNonTactics = [i for i, f in enumerate(r.flags)
-                          if f.has_card(1-me) and
-                             False in [c in TACTICS for c in f.played[1-me]]]
     if tacticsCard == 'Tr':
-        return yourFullNonTactics != [] and myEmpty != []
+        return r.openMasks[me] != 0 and any(
+            f.has_card(1-me) and not all(c in TACTICS for c in f.played[1-me])
+            for f in r.flags)
 
-    myFull = [i for i, f in enumerate(r.flags) if f.has_card(me)]
     if tacticsCard == 'Re':
-        return myFull != []
+        return any(f.has_card(me) for f in r.flags)
 
 def find_play_to_win_flag(r, card, iFlag, p): # TODO: troop cards
     """Check whether this card can win this flag for the current player.  If
@@ -260,9 +708,407 @@ def find_play_to_win_flag(r, card, iFlag, p): # TODO: troop cards
     
     return None # Mud and Scout never immediately win a flag.
 
+class ThreatMap():
+    """Tactics plays that would win the game for a player at a position.
+
+    Build one per turn and share it: each flag is checked for deciding the
+    game once, and each card is tried at each such flag at most once.
+
+    flags (list of int): Unsettled flags that would win the game for p
+    targets (dict): find_play_to_win_flag result for each (card, flag) tried
+    """
+
+    def __init__(self, r, p):
+        self.r = r
+        self.p = p
+        self.flags = [i for i, f in enumerate(r.flags)
+                      if f.winner == None and flag_wins_game(r, i, p)]
+        self.targets = {}
+
+    def target(self, card, iFlag):
+        """Return where to play card to win flag iFlag (or None)."""
+        key = card, iFlag
+        if key not in self.targets:
+            self.targets[key] = find_play_to_win_flag(self.r, card, iFlag,
+                                                      self.p)
+        return self.targets[key]
+
+    def winning_play(self, cards):
+        """Return the first (card, target) among cards that wins the game,
+        trying flags in order (or None)."""
+        for card in cards:
+            if card in TACTICS:
+                for i in self.flags:
+                    target = self.target(card, i)
+                    if target != None:
+                        return card, target
+        return None
+
 def flag_wins_game(r, iFlag, p):
-    oldWinner = r.flags[iFlag].winner
-    r.flags[iFlag].winner = p # Change game to hypothetical state.
-    out = r.check_winner() == p
-    r.flags[iFlag].winner = oldWinner # Reset game state.
-    return out
+    return r.claim_wins(iFlag, p)
+
+PlayoutStats = collections.namedtuple('PlayoutStats',
+                                      ['playouts', 'wins', 'flagWins'])
+PlayoutStats.__doc__ = """Outcomes of random playouts from one position.
+
+playouts (int): Playouts run
+wins (tuple of 2 int): Playouts each player won (the rest were drawn)
+flagWins (tuple of 9 tuple of 2 int): Playouts in which each player took
+                                      each flag
+"""
+NUMPY_MIN_PLAYOUTS = 64 # Fewest playouts worth running side by side
+
+def random_playouts(r, nPlayouts, rng=None, me=None):
+    """Play the round out nPlayouts times at random.  Return PlayoutStats.
+
+    Both players follow Kenny's policy: a random troop from hand at a random
+    open flag, drawing troops (tactics are never played).  A flag is only
+    settled once both sides are complete, with no proofs, and when neither
+    player can move, a flag with one complete side goes to that side.  With
+    NumPy, the playouts run side by side as arrays.
+
+    rng (random.Random): Seeds the playouts (default: r.rng)
+    me (int or None): If given, each playout first deals the troops that
+                      player can't see (the other hand and the troop deck)
+                      at random; otherwise, every playout uses the real hands
+                      and deck order
+    """
+    if rng == None:
+        rng = r.rng
+    return run_playouts(playout_start(r, me), nPlayouts, rng.getrandbits(32))
+
+def run_playouts(start, nPlayouts, seed):
+    """Play random playouts from a playout_start.  Return PlayoutStats.
+
+    Takes only plain data, so batches can be sent to worker processes.
+    """
+    if numpy != None and nPlayouts >= NUMPY_MIN_PLAYOUTS:
+        return random_playouts_numpy(start, nPlayouts, seed)
+
+    rng = random.Random(seed)
+    wins = [0] * N_PLAYERS
+    flagWins = [[0] * N_PLAYERS for i in range(N_FLAGS)]
+    for iPlayout in range(nPlayouts):
+        winner, outcomes = random_playout(start, rng)
+        if winner != None:
+            wins[winner] += 1
+        for i, flagWinner in enumerate(outcomes):
+            if flagWinner >= 0:
+                flagWins[i][flagWinner] += 1
+    return PlayoutStats(nPlayouts, tuple(wins),
+                        tuple(tuple(counts) for counts in flagWins))
+
+def playout_start(r, me=None):
+    """Reduce a position to what random playouts need (dict)."""
+    start = {'p':r.whoseTurn,
+             'sizes':[FORMATION_SIZE + ('mud' in f.special) for f in r.flags],
+             'specials':[f.special for f in r.flags],
+             'outcomes':[-1 if f.winner == None else f.winner
+                         for f in r.flags],
+             'wonMasks':r.wonMasks[:],
+             'played':[[side[:] for side in f.played] for f in r.flags],
+             'hands':[[c for c in h.cards if c not in TACTICS] for h in r.h],
+             'deck':r.decks['troop'][:]}
+    if me != None:
+        start['hands'][1 - me] = None # Dealt in each playout
+        start['hidden'] = [c for c in r.cardsLeft['troop']
+                           if not r.h[me].mask & CARD_BITS[c]]
+    return start
+
+def random_playout(start, rng):
+    """Play one random playout (see random_playouts).  Return the winner (or
+    None) and each flag's winner (list, -1 if unsettled)."""
+    sizes, specials = start['sizes'], start['specials']
+    outcomes, wonMasks = start['outcomes'][:], start['wonMasks'][:]
+    played = [[side[:] for side in flag] for flag in start['played']]
+    hands = [None if h == None else h[:] for h in start['hands']]
+    deck = start['deck'][:]
+    if 'hidden' in start:
+        hidden = start['hidden'][:]
+        rng.shuffle(hidden)
+        deck = hidden[:len(deck)]
+        hands[hands.index(None)] = hidden[len(deck):]
+
+    p, passes = start['p'], 0
+    while passes < 2:
+        openFlags = [i for i in range(N_FLAGS)
+                     if outcomes[i] < 0 and len(played[i][p]) < sizes[i]]
+        if hands[p] == [] or openFlags == []:
+            passes += 1
+            p = 1 - p
+            continue
+        passes = 0
+
+        card = hands[p].pop(rng.randrange(len(hands[p])))
+        i = rng.choice(openFlags)
+        if deck != []:
+            hands[p].append(deck.pop())
+        played[i][p].append(card)
+        if len(played[i][p]) == sizes[i] == len(played[i][1-p]):
+            outcomes[i] = compare_formations(
+                [detect_formation(tuple(side), specials[i])
+                 for side in played[i]], p)
+            wonMasks[outcomes[i]] |= 1 << i
+            if wins_round(wonMasks[outcomes[i]]):
+                return outcomes[i], outcomes
+        p = 1 - p
+
+    for i in range(N_FLAGS): # Out of moves: complete sides take their flags.
+        complete = [len(side) == sizes[i] for side in played[i]]
+        if outcomes[i] < 0 and complete.count(True) == 1:
+            outcomes[i] = complete.index(True)
+            wonMasks[outcomes[i]] |= 1 << i
+    return find_round_winner_by_masks(wonMasks), outcomes
+
+def random_playouts_numpy(start, nPlayouts, seed):
+    """Same as random_playouts, but runs every playout side by side.
+
+    Each side of each flag is tracked as its card count, its values read as
+    a base-10 number, and whether it is a flush, which is all it takes to
+    look up its strength in FORMATION_TABLES once complete.  Sides with wild
+    tactics already played are scored one by one instead.  Hands and open
+    flags are kept packed at the front of their rows, so a random pick is a
+    single index.  Every array is flat (one row per playout, laid end to
+    end), since NumPy gathers from flat arrays fastest.
+    """
+    np = numpy
+    rng = np.random.default_rng(seed)
+    K, p = nPlayouts, start['p']
+    S, W = 2 * N_FLAGS, HAND_SIZE + 2 # Sides of flags; hand room for Scout
+    rows = np.arange(K)
+    sizes = np.array(start['sizes'])
+    fog = np.array(['fog' in special for special in start['specials']])
+    tables, offsets, winsTable = playout_tables()
+    offsets = offsets[sizes - FORMATION_SIZE]
+
+    # Sides of flags are indexed 2 * flag + player.
+    count0, key0, flush0, firstSuit0 = [np.zeros(S, dtype=int)
+                                        for i in range(4)]
+    wild = np.zeros(S, dtype=bool)
+    for i, flag in enumerate(start['played']):
+        for q, side in enumerate(flag):
+            troops = [c for c in side if c not in TACTICS]
+            count0[2*i + q] = len(side)
+            wild[2*i + q] = len(troops) < len(side)
+            firstSuit0[2*i + q] = CARD_CODES[troops[0]] % N_SUITS \
+                                  if troops else -1
+            flush0[2*i + q] = len(set(c[1] for c in troops)) <= 1
+            for c in troops:
+                key0[2*i + q] = 10 * key0[2*i + q] + CARD_CODES[c] // N_SUITS
+    count, key, flush, firstSuit = [np.tile(a, K) for a in
+                                    (count0, key0, flush0, firstSuit0)]
+    added = np.full(K * S * (FORMATION_SIZE + 1), -1)
+    outcome = np.tile(start['outcomes'], K)
+    won = np.tile(start['wonMasks'], K)
+    openFlags = np.zeros(K * N_PLAYERS * N_FLAGS, dtype=int)
+    nOpen = np.zeros(K * N_PLAYERS, dtype=int)
+    for q in range(N_PLAYERS):
+        flags = [i for i in range(N_FLAGS) if start['outcomes'][i] < 0 and
+                 count0[2*i + q] < sizes[i]]
+        for j, i in enumerate(flags):
+            openFlags[(2*rows + q) * N_FLAGS + j] = i
+        nOpen[2*rows + q] = len(flags)
+
+    # Deal the hands and decks (card codes).
+    nDeck = len(start['deck'])
+    deck = np.tile([CARD_CODES[c] for c in start['deck']], K)
+    hands = np.zeros(K * N_PLAYERS * W, dtype=int)
+    handSizes = np.zeros(K * N_PLAYERS, dtype=int)
+    if 'hidden' in start:
+        hidden = np.array([CARD_CODES[c] for c in start['hidden']],
+                          dtype=int)
+        shuffled = hidden[rng.random((K, len(hidden))).argsort(axis=1)]
+        deck = shuffled[:, :nDeck].ravel()
+        q = start['hands'].index(None)
+        for j in range(len(hidden) - nDeck):
+            hands[(2*rows + q) * W + j] = shuffled[:, nDeck + j]
+        handSizes[2*rows + q] = len(hidden) - nDeck
+    for q, hand in enumerate(start['hands']):
+        if hand != None:
+            for j, c in enumerate(hand):
+                hands[(2*rows + q) * W + j] = CARD_CODES[c]
+            handSizes[2*rows + q] = len(hand)
+    top = np.full(K, nDeck) # Cards left in each deck (drawn from the end)
+
+    def strengths(g, i, q):
+        """Strength of complete side q of flag i in playouts g."""
+        side = 2*i + q
+        s = tables[offsets[i] + 2 * key[g*S + side] + flush[g*S + side]]
+        s = np.where(fog[i], s % 100, s)
+        for j in np.flatnonzero(wild[side]):
+            base = (g[j]*S + side[j]) * (FORMATION_SIZE + 1)
+            cards = start['played'][i[j]][q] + [
+                CARD_NAMES[c] for c in added[base:base + FORMATION_SIZE + 1]
+                if c >= 0]
+            s[j] = detect_formation(tuple(cards),
+                                    start['specials'][i[j]]).strength
+        return s
+
+    winner = np.full(K, -1)
+    active = np.ones(K, dtype=bool)
+    passes = np.zeros(K, dtype=int)
+    while active.any():
+        g = rows[active]
+        mine = 2*g + p # Index of each playout's player p
+        nHand, nFlags = handSizes[mine], nOpen[mine]
+        canPlay = (nHand > 0) & (nFlags > 0)
+        passes[g] = np.where(canPlay, 0, passes[g] + 1)
+        active[g[passes[g] >= 2]] = False
+
+        g, mine = g[canPlay], mine[canPlay]
+        nHand, nFlags = nHand[canPlay], nFlags[canPlay]
+        picks = rng.random((2, len(g)))
+        slot = mine*W + (picks[0] * nHand).astype(int)
+        j = mine*N_FLAGS + (picks[1] * nFlags).astype(int)
+        card, i = hands[slot], openFlags[j]
+        side = g*S + 2*i + p
+        value, suit = card // N_SUITS, card % N_SUITS
+        c = count[side]
+        added[side * (FORMATION_SIZE + 1) + c - count0[2*i + p]] = card
+        firstSuit[side] = np.where(c == 0, suit, firstSuit[side])
+        flush[side] &= suit == firstSuit[side]
+        key[side] = 10 * key[side] + value
+        count[side] = c + 1
+
+        t = top[g] # Draw into the slot played from, or close the gap.
+        drawn = t > 0
+        hands[slot] = np.where(drawn, deck[g*nDeck + np.maximum(t - 1, 0)],
+                               hands[mine*W + nHand - 1])
+        handSizes[mine] = nHand - ~drawn
+        top[g] = t - drawn
+
+        full = c + 1 == sizes[i] # Close the flag to p.
+        openFlags[j[full]] = openFlags[mine[full]*N_FLAGS + nFlags[full] - 1]
+        nOpen[mine[full]] -= 1
+
+        settle = full & (count[side + 1 - 2*p] == sizes[i])
+        if settle.any():
+            g, i = g[settle], i[settle]
+            # Ties go to the other player, who finished first.
+            flagWinner = np.where(strengths(g, i, p) > strengths(g, i, 1 - p),
+                                  p, 1 - p)
+            outcome[g*N_FLAGS + i] = flagWinner
+            won[2*g + flagWinner] |= 1 << i
+            done = winsTable[won[2*g + flagWinner]]
+            winner[g[done]] = flagWinner[done]
+            active[g[done]] = False
+        p = 1 - p
+
+    # Out of moves: complete sides take their flags.
+    outcome = outcome.reshape(K, N_FLAGS)
+    dry = winner < 0
+    complete = (count == np.tile(np.repeat(sizes, 2), K)).reshape(
+        K, N_FLAGS, N_PLAYERS)
+    for q in range(N_PLAYERS):
+        take = dry[:, None] & (outcome < 0) & complete[:, :, q] & \
+               ~complete[:, :, 1 - q]
+        outcome[take] = q
+    bits = 1 << np.arange(N_FLAGS)
+    masks = [((outcome == q) * bits).sum(axis=1) for q in range(N_PLAYERS)]
+    majorities = [np.array(MAJORITIES)[m] for m in masks]
+    ends = np.array([np.array(BREAKTHROUGHS)[m] for m in masks])
+    byBreakthrough = np.where(ends.min(axis=0) < N_FLAGS, ends.argmin(axis=0),
+                              -1)
+    winner = np.where(dry, np.where(majorities[0], 0, np.where(
+        majorities[1], 1, byBreakthrough)), winner)
+
+    return PlayoutStats(K, tuple(int((winner == q).sum())
+                                 for q in range(N_PLAYERS)),
+                        tuple(tuple(int((outcome[:, i] == q).sum())
+                                    for q in range(N_PLAYERS))
+                              for i in range(N_FLAGS)))
+
+@functools.lru_cache(maxsize=1)
+def playout_tables():
+    """Return NumPy copies of FORMATION_TABLES (one after the other), where
+    each formation size's table starts, and wins_round for every mask."""
+    tables = [numpy.array(FORMATION_TABLES[size], dtype=int)
+              for size in (FORMATION_SIZE, FORMATION_SIZE + 1)]
+    return (numpy.concatenate(tables), numpy.array([0, len(tables[0])]),
+            numpy.array([wins_round(m) for m in range(2**N_FLAGS)]))
+
+WinEstimate = collections.namedtuple('WinEstimate',
+                                     ['game', 'flags', 'playouts'])
+WinEstimate.__doc__ = """A player's chances of winning, from random playouts.
+
+game (float): Share of playouts the player won (draws count as losses)
+flags (tuple of 9 float): Share of playouts in which the player took each
+                          flag (0 or 1 for flags already settled)
+playouts (int): Playouts the shares are taken from
+"""
+ESTIMATE_BATCH = 256 # Playouts per job handed to a pool
+ESTIMATE_CACHE = {} # Playouts, wins, and flag wins of estimate_wins, by
+                    # position
+ESTIMATE_CACHE_SIZE = 2**12 # Cleared when full
+ESTIMATE_CACHE_STATS = collections.Counter() # Hits, misses, and evictions
+
+def estimate_wins(r, p=None, nPlayouts=1000, seconds=None, pool=None,
+                  rng=None):
+    """Estimate p's chances of winning the round and each flag.  Return a
+    WinEstimate.
+
+    Only uses what p can see: before each random playout (see
+    random_playouts), the troops p can't see are dealt at random to the
+    other hand and the troop deck.  Playouts run in batches of
+    ESTIMATE_BATCH, until nPlayouts are done or seconds have passed
+    (whichever comes first; at least one batch is always run).
+
+    Playouts are cached by position (as p sees it): a position with at
+    least nPlayouts cached is answered from the cache, and otherwise only
+    the missing playouts are run and added to the cached ones.
+
+    p (int): Whose chances (default: r.whoseTurn)
+    seconds (float or None): Time budget, if any
+    pool (multiprocessing.Pool or None): If given, batches are spread over
+                                         its workers (a ThreadPool works
+                                         too); batches already handed out
+                                         when time runs out still finish
+    rng (random.Random): Seeds the batches (default: r.rng)
+    """
+    if p == None:
+        p = r.whoseTurn
+    if rng == None:
+        rng = r.rng
+    key = (p, r.whoseTurn, r.h[p].mask, r.poolMask, len(r.decks['troop']),
+           tuple((tuple(f.played[0]), tuple(f.played[1]), f.special,
+                  f.winner) for f in r.flags))
+    counts = ESTIMATE_CACHE.get(key)
+    if counts != None and counts[0] >= nPlayouts:
+        ESTIMATE_CACHE_STATS['hits'] += 1
+        return win_estimate(*counts)
+    ESTIMATE_CACHE_STATS['misses'] += 1
+    if counts == None:
+        if len(ESTIMATE_CACHE) >= ESTIMATE_CACHE_SIZE:
+            ESTIMATE_CACHE_STATS['evictions'] += len(ESTIMATE_CACHE)
+            ESTIMATE_CACHE.clear()
+        counts = (0, 0, (0,) * N_FLAGS)
+    done, wins, flagWins = counts[0], counts[1], list(counts[2])
+
+    start = playout_start(r, p)
+    deadline = None if seconds == None else time.perf_counter() + seconds
+    jobs = [(start, min(ESTIMATE_BATCH, nPlayouts - i), rng.getrandbits(32))
+            for i in range(done, nPlayouts, ESTIMATE_BATCH)]
+    if pool == None:
+        batches = (run_playouts(*job) for job in jobs)
+    else:
+        batches = pool.imap_unordered(run_playouts_job, jobs)
+
+    for stats in batches:
+        done += stats.playouts
+        wins += stats.wins[p]
+        for i in range(N_FLAGS):
+            flagWins[i] += stats.flagWins[i][p]
+        if deadline != None and time.perf_counter() >= deadline:
+            break
+
+    ESTIMATE_CACHE[key] = (done, wins, tuple(flagWins))
+    return win_estimate(done, wins, flagWins)
+
+def win_estimate(playouts, wins, flagWins):
+    """Return the WinEstimate for counts of playouts won."""
+    return WinEstimate(wins / playouts,
+                       tuple(n / playouts for n in flagWins), playouts)
+
+def run_playouts_job(job):
+    """Run one batch of estimate_wins (in a worker)."""
+    return run_playouts(*job)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""Compact records of whole rounds, for replays and for mining.
+
+A GameRecorder watches rounds (see Observer in play_bl) and writes one line
+of JSON per round: the seed, the players, both deck orders, every move, and
+the outcome.  Lines are only appended, so a log can grow across runs.
+
+Each move is one short token (see encode_move): the card, its target, the
+deck drawn (or Scout's discards), and any flags settled by the move.  The
+deck orders fix everything else, so replay rebuilds any round exactly,
+without the players or the RNG.
+
+Run this file to replay a logged round verbosely:
+
+    $ ./game_record.py games.jsonl 17
+"""
+
+import sys, argparse, json
+from play_bl import Observer, Display
+from bl_classes import *
+
+DECK_NAMES = ('troop', 'tactics') # Encoded by index
+PASS = '-'
+
+
+def encode_move(play, settled=()):
+    """Return the token (str) for a play (or a pass, if None).
+
+    settled (list): (flag, winner) for each flag the play settled
+    """
+    if play == None:
+        return PASS
+    card, target, deckName = play
+    if card == 'Sc': # Target is 3 deck names; deckName is the discards.
+        token = card + ''.join(str(DECK_NAMES.index(d)) for d in target) + \
+                ''.join(deckName)
+    else:
+        if card == 'De':
+            target = target[0]
+        elif card in ('Tr', 'Re'):
+            target = target[0] + ('-' if target[1] == None else
+                                  str(target[1]))
+        token = card + str(target) + encode_deck(deckName)
+    return token + ''.join('!{}{}'.format(i, p) for i, p in settled)
+
+def encode_deck(deckName):
+    if deckName == None:
+        return '-'
+    return str(DECK_NAMES.index(deckName))
+
+def decode_deck(code):
+    if code == '-':
+        return None
+    return DECK_NAMES[int(code)]
+
+def decode_move(token):
+    """Return the play (or None, for a pass) and settled flags of a token."""
+    token, *settled = token.split('!')
+    settled = [(int(s[:-1]), int(s[-1])) for s in settled]
+    if token == PASS:
+        return None, settled
+
+    card = token[:2]
+    if card == 'Sc':
+        target = tuple(DECK_NAMES[int(d)] for d in token[2:5])
+        return (card, target, [token[5:7], token[7:9]]), settled
+    elif card == 'De':
+        target = (token[2:4],)
+    elif card in ('Tr', 'Re'):
+        target = (token[2:4], None if token[4] == '-' else int(token[4]))
+    else:
+        target = int(token[2])
+    return (card, target, decode_deck(token[-1])), settled
+
+
+class GameRecorder(Observer):
+    """Observer that logs each round as one line of JSON.
+
+    out (file or None): Where lines are written as rounds end (if None,
+                        they are kept in lines instead; see take)
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self.lines = []
+
+    def round_started(self, r, seed):
+        self.seed = seed
+        self.moves = []
+        self.winners = [None] * N_FLAGS
+
+    def passed(self, r):
+        self.moves.append(PASS)
+
+    def played(self, r, play):
+        settled = []
+        for i, f in enumerate(r.flags):
+            if f.winner != self.winners[i]:
+                self.winners[i] = f.winner
+                if f.winner != None:
+                    settled.append((i, f.winner))
+        self.moves.append(encode_move(play, settled))
+
+    def round_ended(self, r, result):
+        line = json.dumps({'seed':self.seed,
+                           'names':[h.name for h in r.h],
+                           'troop':''.join(r.initialDecks['troop']),
+                           'tactics':''.join(r.initialDecks['tactics']),
+                           'moves':' '.join(self.moves),
+                           'winner':result.winner,
+                           'overruns':result.overruns})
+        if self.out == None:
+            self.lines.append(line)
+        else:
+            self.out.write(line + '\n')
+
+    def take(self):
+        """Return the lines kept so far and start over (for workers)."""
+        lines, self.lines = self.lines, []
+        return lines
+
+
+class ScriptedScout():
+    """Stands in for a player to give recorded Scout discards."""
+
+    def __init__(self, discards):
+        self.discards = discards
+
+    def scout_discards(self, r):
+        return self.discards
+
+
+def read_records(path):
+    """Yield each round (dict) logged in a file."""
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+def replay(record, observer=None):
+    """Play a logged round again, move by move.  Return the final Round.
+
+    The observer, if any, is told about each turn.  Raises an exception if
+    the flags settled don't match the record (e.g., the engine's rules have
+    changed since the round was logged).
+    """
+    r = Round([None] * N_PLAYERS, record['names'], observer != None)
+    r.generate_decks_and_deal_hands(
+        {name : [record[name][i:i+2] for i in range(0, len(record[name]), 2)]
+         for name in DECK_NAMES})
+    if observer:
+        observer.round_started(r, record['seed'])
+
+    winners = [None] * N_FLAGS
+    for iMove, token in enumerate(record['moves'].split()):
+        if observer:
+            observer.turn_started(r)
+        play, settled = decode_move(token)
+        if play == None:
+            if observer:
+                observer.passed(r)
+        else:
+            card, target, deckName = play
+            if card == 'Sc':
+                r.make_play(card, target, None, ScriptedScout(deckName))
+            else:
+                r.make_play(card, target, deckName)
+            r.resolve_flags(card)
+
+            newlySettled = []
+            for i, f in enumerate(r.flags):
+                if f.winner != winners[i]:
+                    winners[i] = f.winner
+                    if f.winner != None:
+                        newlySettled.append((i, f.winner))
+            if newlySettled != settled:
+                raise Exception('Replay diverged at move {}'.format(iMove))
+            if observer:
+                observer.played(r, play)
+        r.whoseTurn = 1 - r.whoseTurn
+
+    if r.winner == None: # Forfeited (out of time), or drawn
+        r.winner = record['winner']
+    return r
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a logged round.')
+    parser.add_argument('path', help='log written by bl_wrapper --record')
+    parser.add_argument('index', type=int, help='round (line) number, from 0')
+    args = parser.parse_args()
+
+    nRecords = 0
+    for record in read_records(args.path):
+        if nRecords == args.index:
+            r = replay(record, Display())
+            print('Winner: {}'.format('none (drawn)' if r.winner == None
+                                      else record['names'][r.winner]))
+            return
+        nRecords += 1
+    sys.exit('Only {} rounds logged'.format(nRecords))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Opt-in timing of players and engine phases.
+
+Nothing here costs anything until a Timings object is attached: attaching
+wraps the players' methods and a few Round methods (ENGINE_PHASES) with
+timers, and detaching puts the originals back.  Optionally, each bot's
+moves are also run under cProfile, with results dumped per bot.
+
+While attached, the hits, misses, and evictions of the formation caches
+(see cache_stats in bot_utils) are counted as well.
+"""
+
+import time, os, cProfile, functools
+from bl_classes import *
+
+ENGINE_PHASES = ('resolve_flags', 'try_to_resolve', 'best_empty',
+                 'check_winner')
+PLAYER_METHODS = ('play', 'scout_discards')
+GAME_PHASES = ('opening', 'middle game', 'endgame')
+
+
+def game_phase(r):
+    """Name the phase of the round by the troops still unplayed."""
+    troopsLeft = len(r.cardsLeft['troop'])
+    if troopsLeft > 40:
+        return GAME_PHASES[0]
+    elif troopsLeft > 20:
+        return GAME_PHASES[1]
+    return GAME_PHASES[2]
+
+
+class Timings():
+    """Histograms of wall time per call, keyed by (who, what, game phase).
+
+    who (str): A bot's name (see Player.get_name), or 'engine'
+    what (str): Method timed (from PLAYER_METHODS or ENGINE_PHASES)
+    game phase (str): See game_phase
+
+    calls (dict): Each key's [count, total seconds, max seconds, buckets],
+                  where buckets (dict) counts calls taking from 2**(b-1) to
+                  2**b microseconds under key b
+    profiles (dict or None): A cProfile.Profile per bot, if profiling
+    caches (dict): Each cache's [hits, misses, evictions] while attached
+    """
+
+    def __init__(self, profile=False):
+        self.calls = {}
+        self.profiles = {} if profile else None
+        self.attached = []
+        self.caches = {}
+        self.cacheBase = None # cache_stats when last counted, if attached
+
+    def record(self, key, seconds):
+        stats = self.calls.get(key)
+        if stats == None:
+            stats = self.calls[key] = [0, 0.0, 0.0, {}]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        bucket = int(seconds * 1e6).bit_length()
+        stats[3][bucket] = stats[3].get(bucket, 0) + 1
+
+    def merge(self, calls, caches={}):
+        """Add histograms and cache counts from another Timings (e.g., from
+        take)."""
+        for key, (count, total, longest, buckets) in calls.items():
+            stats = self.calls.get(key)
+            if stats == None:
+                stats = self.calls[key] = [0, 0.0, 0.0, {}]
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], longest)
+            for bucket, n in buckets.items():
+                stats[3][bucket] = stats[3].get(bucket, 0) + n
+        for name, counts in caches.items():
+            total = self.caches.setdefault(name, [0, 0, 0])
+            for i, n in enumerate(counts):
+                total[i] += n
+
+    def count_caches(self):
+        """Add the cache counts since last counted."""
+        if self.cacheBase == None:
+            return
+        now = cache_stats()
+        self.merge({}, {name : [s[i] - self.cacheBase[name][i]
+                                for i in range(3)]
+                        for name, s in now.items()})
+        self.cacheBase = now
+
+    def take(self):
+        """Return the histograms and cache counts so far, and start over
+        (for workers)."""
+        self.count_caches()
+        calls, self.calls = self.calls, {}
+        caches, self.caches = self.caches, {}
+        return calls, caches
+
+    def attach(self, players):
+        """Start timing the players' methods and the engine phases."""
+        for name in ENGINE_PHASES:
+            setattr(Round, name, self.timed_engine_phase(getattr(Round, name),
+                                                         name))
+        for player in players:
+            for name in PLAYER_METHODS:
+                setattr(player, name,
+                        self.timed_player_method(player, name))
+        self.attached = players
+        self.cacheBase = cache_stats()
+
+    def detach(self):
+        """Stop timing (put the original methods back)."""
+        self.count_caches()
+        self.cacheBase = None
+        for name in ENGINE_PHASES:
+            setattr(Round, name, getattr(Round, name).__wrapped__)
+        for player in self.attached:
+            for name in PLAYER_METHODS:
+                delattr(player, name)
+        self.attached = []
+
+    def timed_engine_phase(self, method, name):
+        @functools.wraps(method)
+        def timed(r, *args):
+            start = time.perf_counter()
+            result = method(r, *args)
+            self.record(('engine', name, game_phase(r)),
+                        time.perf_counter() - start)
+            return result
+        return timed
+
+    def timed_player_method(self, player, name):
+        method = getattr(player, name)
+        who = player.get_name()
+        profile = None
+        if self.profiles != None:
+            profile = self.profiles.setdefault(who, cProfile.Profile())
+
+        def timed(r):
+            if profile:
+                profile.enable()
+            start = time.perf_counter()
+            try:
+                return method(r)
+            finally: # Even if cut short (e.g., by MoveTimeout)
+                elapsed = time.perf_counter() - start
+                if profile:
+                    profile.disable()
+                self.record((who, name, game_phase(r)), elapsed)
+        return timed
+
+    def dump_profiles(self, directory):
+        """Write each bot's profile to <directory>/<bot>.prof (see pstats)."""
+        os.makedirs(directory, exist_ok=True)
+        for who, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, who + '.prof'))
+
+    def report(self):
+        """Return a table of the histograms (list of str), slowest first."""
+        lines = ['{:10} {:15} {:12} {:>9} {:>9} {:>9} {:>9}'.format(
+                 'who', 'what', 'phase', 'calls', 'mean ms', 'p95 ms',
+                 'max ms')]
+        for key, (count, total, longest, buckets) in sorted(
+                self.calls.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                '{:10} {:15} {:12} {:9} {:9.3f} {:9.3f} {:9.3f}'.format(
+                *key, count, 1e3 * total / count,
+                min(percentile(buckets, count, 0.95), 1e3 * longest),
+                1e3 * longest))
+
+        if self.caches:
+            lines += ['', '{:26} {:>12} {:>12} {:>12} {:>9}'.format(
+                      'cache', 'hits', 'misses', 'evictions', 'hit rate')]
+        for name, (hits, misses, evictions) in sorted(self.caches.items()):
+            lines.append('{:26} {:12} {:12} {:12} {:9.1%}'.format(
+                         name, hits, misses, evictions,
+                         hits / max(hits + misses, 1)))
+        return lines
+
+
+def percentile(buckets, count, q):
+    """Estimate a percentile (ms) from a histogram (upper bucket bound)."""
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= q * count:
+            return 2**bucket / 1e3
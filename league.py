@@ -0,0 +1,243 @@
+"""Round-robin leagues: every pairing of players, rated by Elo.
+
+Intended to be imported into a wrapper (bl_wrapper).  Each pairing plays
+rounds in batches, alternating seats, spread over a pool of worker
+processes; results stream back as rounds finish.  Optionally, a pairing
+stops early once its score is known well enough (sequential testing), so
+no time is wasted on pairings that are already decided.
+
+In duplicate mode, every pairing plays the same deals, each twice with
+seats swapped (see tournament), and scores are judged per deal.
+
+Rounds can be logged as they finish (see game_record).
+"""
+
+import multiprocessing, itertools, collections, queue, random, math
+from tournament import make_players, play_seeded_round
+from game_record import GameRecorder
+
+LEAGUE_Z = 3.0           # Interval width (sd) for stopping; wide, since
+                         # it's checked after every batch
+ELO_SCALE = 400 / math.log(10)
+ELO_MEAN = 1500
+N_BOOTSTRAPS = 200       # Resamples for rating confidence intervals
+
+leagueWorkerState = {} # Per-process players for each seating, limits,
+                       # and recorder
+
+
+class Pairing():
+    """Tally of the rounds between two players, in both seat orders.
+
+    names (tuple of 2 str): The players (registered names)
+    seed (str): Seed for this pairing's rounds (see round_seed)
+    duplicate (bool): Whether rounds 2k and 2k + 1 share deal k
+    rounds (int): Rounds finished
+    score (float): Wins of names[0], plus half of the draws
+    halfDeals (dict): Score of names[0] in each deal played only once yet
+    deals (list of float): Mean score of names[0] in each finished deal
+    scheduled (int): Rounds handed out so far
+    done (bool): Whether no more rounds will be scheduled
+    """
+
+    def __init__(self, names, seed, duplicate=False):
+        self.names = names
+        self.seed = seed
+        if not duplicate: # Else all pairings share deals.
+            self.seed = '{}:{}:{}'.format(seed, *names)
+        self.duplicate = duplicate
+        self.rounds = 0
+        self.score = 0.0
+        self.halfDeals = {}
+        self.deals = []
+        self.scheduled = 0
+        self.done = False
+
+    def seats(self, iRound):
+        """Return the players in seat order for a round (seats alternate)."""
+        if iRound % 2 == 1:
+            return self.names[::-1]
+        return self.names
+
+    def deal(self, iRound):
+        """Return the index of a round's deal (for round_seed)."""
+        if self.duplicate:
+            return iRound // 2
+        return iRound
+
+    def record(self, iRound, result):
+        self.rounds += 1
+        score = 0.5
+        if result.winner != None:
+            score = float(self.seats(iRound)[result.winner] == self.names[0])
+        self.score += score
+
+        if self.duplicate:
+            iDeal = self.deal(iRound)
+            if iDeal in self.halfDeals:
+                self.deals.append((self.halfDeals.pop(iDeal) + score) / 2)
+            else:
+                self.halfDeals[iDeal] = score
+
+    def rate(self):
+        """Return the score rate of names[0] (float)."""
+        return self.score / self.rounds
+
+    def half_width(self, z=LEAGUE_Z):
+        """Return the half-width of the interval around rate."""
+        return z * self.standard_error()
+
+    def standard_error(self):
+        """Return the standard error of rate (never quite 0)."""
+        if self.duplicate: # From the spread of deal scores
+            n = len(self.deals)
+            mean = sum(self.deals) / n
+            spread = sum((d - mean)**2 for d in self.deals) + 0.25 # Prior
+            return math.sqrt(spread / n / n)
+        p = (self.score + 0.5) / (self.rounds + 1) # Never exactly 0 or 1
+        return math.sqrt(p * (1 - p) / self.rounds)
+
+    def settled(self, precision):
+        """Check whether the rate is known to within precision, or is
+        clearly above or below one half."""
+        halfWidth = self.half_width()
+        return halfWidth <= precision or abs(self.rate() - 0.5) > halfWidth
+
+
+def init_league_worker(timeControl, recorded=False):
+    """Set up a worker process (players are built when first needed)."""
+    leagueWorkerState['players'] = {}
+    leagueWorkerState['timeControl'] = timeControl
+    leagueWorkerState['recorder'] = GameRecorder() if recorded else None
+
+def play_league_round(pairingIndex, seats, seed, iRound, iDeal):
+    """Play one round.  Return where it belongs, its RoundResult, and its
+    record (a line of the log), if recording."""
+    s = leagueWorkerState
+    if seats not in s['players']:
+        s['players'][seats] = make_players(seats)
+    result = play_seeded_round(s['players'][seats], seats, False, seed,
+                               iDeal, s['timeControl'], s['recorder'])
+    lines = None
+    if s['recorder'] != None:
+        lines = s['recorder'].take()
+    return pairingIndex, iRound, result, lines
+
+def play_league(playerNames, maxRounds, seed, workers=1, precision=None,
+                batch=20, timeControl=None, duplicate=False, record=None):
+    """Play every pairing of players.  Yield (Pairing, RoundResult) pairs as
+    rounds finish.
+
+    maxRounds (int): Most rounds per pairing
+    precision (float or None): If given, stop a pairing once settled (see
+                               Pairing.settled; checked after each batch)
+    batch (int): Rounds scheduled at a time for each pairing (even, if
+                 duplicate)
+    duplicate (bool): Whether to play each deal twice, swapping seats
+    record (file): If given, log every round to it (see game_record)
+    """
+    pairings = [Pairing(names, seed, duplicate)
+                for names in itertools.combinations(playerNames, 2)]
+
+    finished = queue.Queue()
+    pool = None
+    if workers == 1:
+        init_league_worker(timeControl, record != None)
+        pending = collections.deque()
+        submit = pending.append
+        def next_result():
+            return play_league_round(*pending.popleft())
+    else:
+        pool = multiprocessing.Pool(workers, init_league_worker,
+                                    (timeControl, record != None))
+        def submit(job):
+            pool.apply_async(play_league_round, job, callback=finished.put,
+                             error_callback=finished.put)
+        def next_result():
+            result = finished.get()
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+    def schedule(i):
+        """Hand out the next batch of a pairing's rounds."""
+        p = pairings[i]
+        for iRound in range(p.scheduled, min(p.scheduled + batch, maxRounds)):
+            submit((i, p.seats(iRound), p.seed, iRound, p.deal(iRound)))
+        p.scheduled = min(p.scheduled + batch, maxRounds)
+
+    try:
+        [schedule(i) for i in range(len(pairings))]
+        nActive = len(pairings)
+        while nActive > 0:
+            i, iRound, result, lines = next_result()
+            if lines != None:
+                record.writelines(line + '\n' for line in lines)
+            p = pairings[i]
+            p.record(iRound, result)
+            if p.rounds == p.scheduled: # Batch finished
+                p.done = p.rounds == maxRounds or (precision != None and
+                                                   p.settled(precision))
+                if p.done:
+                    nActive -= 1
+                else:
+                    schedule(i)
+            yield p, result
+    finally:
+        if pool != None:
+            pool.terminate()
+
+def elo_ratings(pairings, rng=None):
+    """Fit Elo ratings to the pairings' scores (Bradley-Terry model).
+
+    Return a dict mapping each player to (rating, low, high), where low and
+    high bound a 95% interval (from resampled scores).  Every pairing
+    counts one extra drawn round, so perfect scores have finite ratings.
+    """
+    if rng == None:
+        rng = random.Random(0)
+    names = sorted(set(name for p in pairings for name in p.names))
+    ratings = fit_elo(names, [(p.names, p.score, p.rounds) for p in pairings])
+
+    resampled = {name : [] for name in names}
+    for i in range(N_BOOTSTRAPS):
+        tallies = []
+        for p in pairings:
+            rate = rng.gauss(p.rate(), p.standard_error())
+            tallies.append((p.names, p.rounds * min(max(rate, 0), 1),
+                            p.rounds))
+        for name, rating in fit_elo(names, tallies).items():
+            resampled[name].append(rating)
+
+    intervals = {}
+    for name in names:
+        samples = sorted(resampled[name])
+        intervals[name] = (ratings[name],
+                           samples[int(0.025 * N_BOOTSTRAPS)],
+                           samples[int(0.975 * N_BOOTSTRAPS) - 1])
+    return intervals
+
+def fit_elo(names, tallies, nIterations=200):
+    """Return the Elo rating of each name (dict), by minorize-maximize.
+
+    tallies (list): (names, score of names[0], rounds) for each pairing
+    """
+    wins = {name : 0.0 for name in names}
+    games = collections.defaultdict(float)
+    for (a, b), score, rounds in tallies:
+        wins[a] += score + 0.5 # One extra draw per pairing
+        wins[b] += rounds - score + 0.5
+        games[a, b] += rounds + 1
+        games[b, a] += rounds + 1
+
+    strength = {name : 1.0 for name in names}
+    for i in range(nIterations):
+        strength = {name : wins[name] / sum(
+                    games[name, other] / (strength[name] + strength[other])
+                    for other in names if games[name, other] > 0)
+                    for name in names}
+        logMean = sum(math.log(s) for s in strength.values()) / len(names)
+        strength = {name : s / math.exp(logMean)
+                    for name, s in strength.items()}
+    return {name : ELO_MEAN + ELO_SCALE * math.log(s)
+            for name, s in strength.items()}
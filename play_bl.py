@@ -3,49 +3,169 @@
 Intended to be imported into a wrapper (bl_wrapper) so that more than one round
 can be played.  Low-level details and thorough documentation are in another
 module (bl_classes).
+
+The engine itself (simulate) prints nothing.  Play-by-play output is an
+optional observer (Display) that the engine notifies as the round goes on.
 """
 
+import collections
 from bl_classes import *
 
-def play_one_round(players, names, verbose):
-    """Play a full round and return the winner (str)."""
-    r = Round(players, names, verbose) # Round master object -- used everywhere
+RoundResult = collections.namedtuple('RoundResult',
+                                     ['winner', 'turns', 'flagsWon', 'passes',
+                                      'overruns'])
+RoundResult.__doc__ = """Compact summary of a finished round.
+
+winner (int or None): Who won (None if drawn by two consecutive passes)
+turns (int): Number of turns taken, passes included
+flagsWon (tuple of 2 int): Flags won by each player
+passes (int): Number of turns passed
+overruns (tuple of 2 int): Moves each player ran out of time on
+"""
+
+def simulate(players, seed=None, names=('', ''), observer=None,
+             timeControl=None):
+    """Play a full round and return a RoundResult.
+
+    The round's RNG (Round.rng, shared with the players) is seeded with
+    the seed, if given, so the same seed and players give the same round.
+    The observer, if any, is told about each turn (see Observer).  Players'
+    time is limited by timeControl, if given (see TimeControl in
+    bl_classes).
+    """
+    r = Round(players, names, observer != None, timeControl,
+              random.Random(seed)) # Master object
     r.generate_decks_and_deal_hands()
+    if observer:
+        observer.round_started(r, seed)
 
+    turns, passes = 0, 0
     lastPlayerPassed = False
     while r.winner == None: # Take turns until game ends.
-        hand = r.h[r.whoseTurn]
-        if verbose:
-            padLength = hand.show()
+        if observer:
+            observer.turn_started(r)
 
         play = r.get_play(players[r.whoseTurn]) # Do a turn.
+        turns += 1
+        if r.winner != None: # Forfeited (out of time)
+            break
         if play == None: # Allow passing.
-            if verbose:
-                print(padLength * ' ' + 'Passes\n')
+            passes += 1
+            if observer:
+                observer.passed(r)
             if lastPlayerPassed: # Two consecutive draws
-                return 'none (drawn)'
+                break
             lastPlayerPassed = True
         else:
             lastPlayerPassed = False
-            card, target, deckName = play
+            r.resolve_flags(play[0])
+
+            if observer:
+                observer.played(r, play)
+
+        r.whoseTurn = 1 - r.whoseTurn
+
+    flagsWon = tuple([f.winner for f in r.flags].count(p)
+                     for p in range(N_PLAYERS))
+    for player in players:
+        player.round_ended(r)
+    result = RoundResult(r.winner, turns, flagsWon, passes,
+                         tuple(r.overruns))
+    if observer:
+        observer.round_ended(r, result)
+    return result
 
-            if card in r.best['cards']:
-                r.best = r.best_empty()
+def play_one_round(players, names, verbose, seed=None, timeControl=None):
+    """Play a full round and return the winner (str)."""
+    return winner_name(play_observed_round(players, names, verbose, seed,
+                                           timeControl), names)
 
-            if card in r.bestMud['cards']:
-                r.bestMud = r.best_empty(True)
+def play_observed_round(players, names, verbose, seed=None,
+                        timeControl=None, recorder=None):
+    """Play a full round, displayed if verbose.  Return a RoundResult.
 
-            for f in r.flags:
-                r.update_flag(f, card) # Track best possible continuation.
-                f.try_to_resolve(r.whoseTurn)
+    recorder (Observer): If given, also told about each turn (e.g., a
+                         GameRecorder from game_record)
+    """
+    observers = []
+    if verbose:
+        observers.append(Display())
+    if recorder != None:
+        observers.append(recorder)
 
-            r.winner = r.check_winner()
+    observer = None
+    if len(observers) == 1:
+        observer = observers[0]
+    elif len(observers) > 1:
+        observer = ObserverGroup(observers)
+    return simulate(players, seed, names, observer, timeControl)
 
-            if verbose:
-                print(padLength * ' ' + 'Plays {} at {}'.format(card, target))
-                print(padLength * ' ' + 'Draws {}\n'.format(deckName))
-                r.show_flags()
+def winner_name(result, names):
+    """Return the name of a RoundResult's winner (str)."""
+    if result.winner == None:
+        return 'none (drawn)'
+    return names[result.winner]
 
-        r.whoseTurn = 1 - r.whoseTurn
 
-    return r.h[r.winner].name
+class Observer():
+    """Class to inherit when watching rounds played by simulate.
+
+    Override any of the methods; each is called with the Round.  For a
+    Scout play, the play's deck name is the list of the two discards.
+    """
+
+    def round_started(self, r, seed):
+        """Called once the hands are dealt."""
+        pass
+
+    def turn_started(self, r):
+        pass
+
+    def passed(self, r):
+        pass
+
+    def played(self, r, play):
+        """Called after a play is made and flags are resolved."""
+        pass
+
+    def round_ended(self, r, result):
+        """Called with the round's RoundResult."""
+        pass
+
+
+class ObserverGroup(Observer):
+    """Observer that passes every call on to several observers."""
+
+    def __init__(self, observers):
+        self.observers = observers
+
+    def round_started(self, r, seed):
+        [o.round_started(r, seed) for o in self.observers]
+
+    def turn_started(self, r):
+        [o.turn_started(r) for o in self.observers]
+
+    def passed(self, r):
+        [o.passed(r) for o in self.observers]
+
+    def played(self, r, play):
+        [o.played(r, play) for o in self.observers]
+
+    def round_ended(self, r, result):
+        [o.round_ended(r, result) for o in self.observers]
+
+
+class Display(Observer):
+    """Observer that prints the play-by-play (verbose output)."""
+
+    def turn_started(self, r):
+        self.padLength = r.h[r.whoseTurn].show()
+
+    def passed(self, r):
+        print(self.padLength * ' ' + 'Passes\n')
+
+    def played(self, r, play):
+        card, target, deckName = play
+        print(self.padLength * ' ' + 'Plays {} at {}'.format(card, target))
+        print(self.padLength * ' ' + 'Draws {}\n'.format(deckName))
+        r.show_flags()
@@ -1,6 +1,7 @@
 """The simplest possible player.
 
-Kenny plays only troops, at random, and draws troops if available.
+Kenny plays only troops, at random, and draws troops if available.  (For
+many quick games like his, see random_playouts in bot_utils.)
 """
 
 from bl_classes import *
@@ -13,18 +14,14 @@ class KennyPlayer(Player):
     def play(self, r):
         me = r.whoseTurn
 
-        cards = r.h[me].cards
-        card = random.choice(cards)
-        while card in TACTICS:
-            card = random.choice(cards)
+        troops = [c for c in r.h[me].cards if c not in TACTICS]
+        playableFlags = r.open_flags(me)
 
-        playableFlags = [i for i, f in enumerate(r.flags)
-                         if f.slots_left(me) > 0]
-
-        if len(playableFlags) == 0:
+        if len(troops) == 0 or len(playableFlags) == 0:
             return None, None, None # Pass.
+        card = r.rng.choice(troops)
 
-        return card, random.choice(playableFlags), r.prefer_deck('troop')
+        return card, r.rng.choice(playableFlags), r.prefer_deck('troop')
 
     def scout_discards(self, r):
         pass # Never play tactics.
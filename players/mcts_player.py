@@ -0,0 +1,284 @@
+"""A patient gambler.
+
+MCTS Player imagines many endings to the round before each move.  He guesses
+the cards he can't see (his opponent's hand and the order of both decks) from
+the cards not yet played, searches a tree of the troop plays Naive likes best
+with UCT, and finishes each imagined line of play quickly, with a random play
+that fits a formation.  He keeps Sniper's instincts for tactics: he plays them
+only to win on the spot.
+
+He stops thinking after a wall-clock budget or a number of playouts, whichever
+comes first (and well before the round's time limit, if any), and can spread
+the search over several processes (each searches its own tree; visit counts
+are summed at the root).  The number of processes is set by MCTSPlayer.workers
+or the constructor, not by bl_wrapper's -w, which spreads whole rounds; the
+processes are stopped when each round ends.
+"""
+
+import time, math, multiprocessing
+from bl_classes import *
+from players.sniper_player import SniperPlayer
+
+class MCTSPlayer(SniperPlayer):
+    moveTime = 0.5     # Seconds of search per move
+    maxPlayouts = None # Playouts per move, over all workers (None: no limit)
+    workers = 1        # Processes to search with
+    exploration = 0.7  # UCT exploration constant
+    nCandidates = 8    # Troop plays considered at each node of the tree
+    timeMargin = 0.8   # Share of the round's time limit (if any) to search
+
+    def __init__(self, p, moveTime=None, maxPlayouts=None, workers=None):
+        super(MCTSPlayer, self).__init__(p)
+        if moveTime != None:
+            self.moveTime = moveTime
+        if maxPlayouts != None:
+            self.maxPlayouts = maxPlayouts
+        if workers != None:
+            self.workers = workers
+        self.pool = None
+
+    @classmethod
+    def get_name(cls):
+        return 'mcts'
+
+    def round_ended(self, r):
+        self.close()
+
+    def close(self):
+        """Stop the search processes, if any (restarted when needed)."""
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def play(self, r):
+        threats = ThreatMap(r, r.whoseTurn) # Shared by the checks below
+        winningPlay = self.find_winning_tactics_play(r, threats)
+        if winningPlay is not None:
+            return winningPlay
+
+        moves = candidate_moves(r, r.whoseTurn, self.nCandidates)
+        if moves == []:
+            return None, None, None # Pass.
+
+        if len(moves) == 1:
+            card, flag = moves[0]
+        else:
+            card, flag = self.search(r)
+
+        deck = r.prefer_deck('troop')
+        if self.exists_winning_tactics_draw(r, threats):
+            deck = r.prefer_deck('tactics')
+        return card, flag, deck
+
+    def search(self, r):
+        """Return the most visited root move, summed over all workers."""
+        workers = self.workers
+        if multiprocessing.current_process().daemon:
+            workers = 1 # Already a pool worker; can't have children.
+
+        moveTime = self.moveTime
+        timeLeft = r.time_left()
+        if timeLeft != None:
+            moveTime = min(moveTime, self.timeMargin * timeLeft)
+        maxPlayouts = self.maxPlayouts
+        if maxPlayouts != None:
+            maxPlayouts = max(1, maxPlayouts // workers)
+        jobs = [(r, moveTime, maxPlayouts, self.exploration,
+                 self.nCandidates, r.rng.random()) for i in range(workers)]
+
+        if workers == 1:
+            results = [run_search(*jobs[0])]
+        else:
+            if self.pool == None:
+                self.pool = multiprocessing.Pool(workers)
+            results = self.pool.starmap(run_search, jobs)
+
+        visits = {}
+        for stats in results:
+            for move, (n, wins) in stats.items():
+                visits[move] = visits.get(move, 0) + n
+        return max(visits, key=visits.get)
+
+
+class Node():
+    """One move in the search tree, seen from the player who made it."""
+    __slots__ = ('visits', 'wins', 'available', 'children')
+
+    def __init__(self):
+        self.visits = 0
+        self.wins = 0.0
+        self.available = 0 # Times this move was legal when its parent was hit
+        self.children = {}
+
+def troop_moves(r, p):
+    """List every (card, flag) troop play open to player p."""
+    return [(c, i) for c in r.h[p].cards if c not in TACTICS
+            for i in r.open_flags(p)]
+
+def candidate_moves(r, p, nMoves):
+    """Return the nMoves troop plays Naive likes best (strongest first)."""
+    moves = troop_moves(r, p)
+    if len(moves) <= nMoves:
+        return moves
+    strengths = r.best_case_batch(
+        [[card] + r.flags[flag].played[p] for card, flag in moves],
+        [r.flags[flag].special for card, flag in moves])
+    ranked = sorted(zip(strengths, range(len(moves))), reverse=True)
+    return [moves[i] for s, i in ranked[:nMoves]]
+
+def determinize(r, me, rng):
+    """Deal the cards that 'me' can't see into the other hand and the decks.
+
+    Hidden cards are those publicly left that aren't in my hand.  Each deck
+    keeps its size, and the opponent gets the rest of each kind.
+    """
+    you = 1 - me
+    r.h[you].cards, r.h[you].mask = [], 0
+    for deckName in ('troop', 'tactics'):
+        hidden = [c for c in r.cardsLeft[deckName]
+                  if not r.h[me].mask & CARD_BITS[c]]
+        rng.shuffle(hidden)
+        nDeck = len(r.decks[deckName])
+        r.decks[deckName] = hidden[:nDeck]
+        [r.h[you].add(c) for c in hidden[nDeck:]]
+
+def play_move(r, move):
+    """Play a troop move (or pass, if None) and end the turn."""
+    if move != None:
+        card, flag = move
+        r.make_play(card, flag, r.prefer_deck('troop'))
+        r.resolve_flags(card)
+    r.whoseTurn = 1 - r.whoseTurn
+
+def fitting_playout(r, rng):
+    """Finish a round with random troop plays.  Return the winner (or None).
+
+    Works on plain lists rather than the Round, and settles a flag only once
+    both sides are complete (no proofs), which is much cheaper.
+    """
+    played = [[f.played[0][:], f.played[1][:]] for f in r.flags]
+    sizes = [FORMATION_SIZE + ('mud' in f.special) for f in r.flags]
+    outcomes = [f.winner for f in r.flags]
+    openFlags = [[i for i in range(N_FLAGS) if outcomes[i] == None and
+                  len(played[i][p]) < sizes[i]] for p in range(N_PLAYERS)]
+    hands = [[c for c in h.cards if c not in TACTICS] for h in r.h]
+    deck = r.decks['troop'][:] # Tactics are never drawn.
+
+    p, passes = r.whoseTurn, 0
+    while passes < 2:
+        if hands[p] == [] or openFlags[p] == []:
+            passes += 1
+            p = 1 - p
+            continue
+        passes = 0
+
+        card, i = fitting_play(hands[p], openFlags[p], played, sizes, p, rng)
+        hands[p].remove(card)
+        if deck != []:
+            hands[p].append(deck.pop())
+        played[i][p].append(card)
+        if len(played[i][p]) == sizes[i]:
+            openFlags[p].remove(i)
+            if len(played[i][1-p]) == sizes[i]: # Both sides complete
+                outcomes[i] = compare_formations(
+                    [detect_formation(tuple(cards), r.flags[i].special)
+                     for cards in played[i]], p)
+                winner = find_round_winner(outcomes)
+                if winner != None:
+                    return winner
+        p = 1 - p
+    return None
+
+def fitting_play(hand, openFlags, played, sizes, p, rng):
+    """Pick a quick, plausible (card, flag) play for a playout.
+
+    Prefers plays that keep a flag on track for a strong formation; ties
+    are broken at random.
+    """
+    bestScore, bestPlays = -1, []
+    for card in hand:
+        for i in openFlags:
+            if played[i][p] == [] or \
+                    not TACTICS.keys().isdisjoint(played[i][p]): # Wilds
+                score = 1
+            else:
+                straight, triple, flush = check_formation_components(
+                    tuple(played[i][p]) + (card,), sizes[i])
+                score = 2 * (straight and flush) + 2 * triple + flush + \
+                        straight
+            if score > bestScore:
+                bestScore, bestPlays = score, [(card, i)]
+            elif score == bestScore:
+                bestPlays.append((card, i))
+    return rng.choice(bestPlays)
+
+def run_search(r, moveTime, maxPlayouts, exploration, nCandidates, seed):
+    """Search from the current player's view of r.  Return root stats.
+
+    Root stats map each root move to (visits, wins).  Only the nCandidates
+    most promising troop plays (see candidate_moves) are searched at each
+    node.
+    """
+    deadline = time.perf_counter() + moveTime
+    rng = random.Random(seed)
+    me = r.whoseTurn
+    rootState = r.snapshot()
+    d = copy.deepcopy(r) # Scratch round for imagined play
+    d.undoStack = []
+    root = Node()
+    rootMoves = candidate_moves(r, me, nCandidates) or [None] # Same each time
+
+    nPlayouts = 0
+    while time.perf_counter() < deadline and nPlayouts != maxPlayouts:
+        d.restore(rootState)
+        determinize(d, me, rng)
+        path = [(root, None)] # (node, player who moved into it)
+        node, passes = root, 0
+
+        # Selection and expansion
+        while d.winner == None and passes < 2:
+            if node == root:
+                moves = rootMoves
+            else:
+                moves = candidate_moves(d, d.whoseTurn, nCandidates) or [None]
+            for move in moves: # None is a pass.
+                if move in node.children:
+                    node.children[move].available += 1
+            untried = [m for m in moves if m not in node.children]
+            mover = d.whoseTurn
+            if untried != []:
+                move = untried[0] # Most promising first
+                child = node.children[move] = Node()
+                child.available = 1
+            else:
+                move = max(moves, key=lambda m: uct(node.children[m],
+                                                    exploration))
+                child = node.children[move]
+            play_move(d, move)
+            passes = passes + 1 if move == None else 0
+            path.append((child, mover))
+            node = child
+            if untried != []:
+                break
+
+        winner = d.winner
+        if winner == None and passes < 2:
+            winner = fitting_playout(d, rng)
+
+        # Backpropagation
+        for node, mover in path:
+            node.visits += 1
+            if winner == None: # Drawn
+                node.wins += 0.5
+            elif winner == mover:
+                node.wins += 1
+        nPlayouts += 1
+
+    return {move : (child.visits, child.wins)
+            for move, child in root.children.items()}
+
+def uct(node, exploration):
+    """Upper confidence bound, counting only the times a move was legal."""
+    return node.wins / node.visits + \
+           exploration * math.sqrt(math.log(node.available) / node.visits)
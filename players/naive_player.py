@@ -16,26 +16,25 @@ class NaivePlayer(Player):
 
     def play(self, r):
         me = r.whoseTurn
-        playableFlags = [i for i,f in enumerate(r.flags)
-                         if f.slots_left(me) > 0]
+        playableFlags = r.open_flags(me)
         if len(playableFlags) == 0:
             return None, None, None # Pass.
 
+        played = {i : tuple(r.flags[i].played[me]) for i in playableFlags}
+        plays = [{'card':c, 'flag':iFlag} for c in r.h[me].cards
+                 if c not in TACTICS for iFlag in playableFlags]
+        strengths = r.best_case_batch(
+            [(p['card'],) + played[p['flag']] for p in plays],
+            [r.flags[p['flag']].special for p in plays])
+
         bestFlagStrength = -1
         bestPlays = []
-        for c in r.h[me].cards:
-            if c in TACTICS:
-                continue
-            for iFlag in playableFlags:
-                f = r.flags[iFlag]
-                candidate = [c] + f.played[me]
-                s = r.best_case_no_wilds(candidate, f.special)['strength']
-
-                if s > bestFlagStrength:
-                    bestFlagStrength = s
-                    bestPlays = [{'card':c, 'flag':iFlag}]
-                elif s == bestFlagStrength:
-                    bestPlays.append({'card':c, 'flag':iFlag})
+        for p, s in zip(plays, strengths):
+            if s > bestFlagStrength:
+                bestFlagStrength = s
+                bestPlays = [p]
+            elif s == bestFlagStrength:
+                bestPlays.append(p)
 
         iBestFlag = self.most_central_flag([p['flag'] for p in bestPlays])
         for p in bestPlays:
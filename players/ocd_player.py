@@ -28,10 +28,9 @@ class OCDPlayer(Player):
                 flag = r.flags[number]
                 return card, number, r.prefer_deck('troop')
 
-        playableFlags = [i for i, f in enumerate(r.flags)
-                         if f.slots_left(me) > 0]
+        playableFlags = r.open_flags(me)
 
         if len(playableFlags) == 0:
             return None, None, None # Pass.
 
-        return cards[0], random.choice(playableFlags), r.prefer_deck('troop')
+        return cards[0], r.rng.choice(playableFlags), r.prefer_deck('troop')
@@ -25,10 +25,9 @@ class RacistPlayer(Player):
                 flag = r.flags[color]
                 return card, color, r.prefer_deck('troop')
 
-        playableFlags = [i for i, f in enumerate(r.flags)
-                         if f.slots_left(me) > 0]
+        playableFlags = r.open_flags(me)
 
         if len(playableFlags) == 0:
             return None, None, None # Pass.
 
-        return cards[0], random.choice(playableFlags), r.prefer_deck('troop')
+        return cards[0], r.rng.choice(playableFlags), r.prefer_deck('troop')
@@ -15,7 +15,8 @@ class SniperPlayer(NaivePlayer):
         return 'sniper'
 
     def play(self, r):
-        winningPlay = self.find_winning_tactics_play(r)
+        threats = ThreatMap(r, r.whoseTurn) # Shared by the checks below
+        winningPlay = self.find_winning_tactics_play(r, threats)
         if winningPlay is not None:
             return winningPlay
 
@@ -25,30 +26,22 @@ class SniperPlayer(NaivePlayer):
         # Play recommended by parent non-tactics player
         card, flag, deck = super().play(r)
 
-        if self.exists_winning_tactics_draw(r):
+        if self.exists_winning_tactics_draw(r, threats):
             deck = r.prefer_deck('tactics')
 
         return card, flag, deck
 
-    def exists_winning_tactics_draw(self, r):
+    def exists_winning_tactics_draw(self, r, threats=None):
         # Edge case: returns true if card is already in hand
-        p = r.whoseTurn
-        for i, f in enumerate(r.flags):
-            if flag_wins_game(r, i, p):
-                for card in r.cardsLeft['tactics']:
-                    if find_play_to_win_flag(r, card, i, p) != None:
-                        return True
-        return False
-
-    def find_winning_tactics_play(self, r):
-        p = r.whoseTurn
-        for card in r.h[p].cards:
-            if card in TACTICS:
-                for i, f in enumerate(r.flags):
-                    if flag_wins_game(r, i, p):
-                        winsFlag = find_play_to_win_flag(r, card, i, p)
-                        if winsFlag != None:
-                            target = winsFlag
-                            deck = r.prefer_deck('tactics') # Arbitrary
-                            return card, target, deck
+        if threats == None:
+            threats = ThreatMap(r, r.whoseTurn)
+        return threats.winning_play(r.cardsLeft['tactics']) != None
+
+    def find_winning_tactics_play(self, r, threats=None):
+        if threats == None:
+            threats = ThreatMap(r, r.whoseTurn)
+        winningPlay = threats.winning_play(r.h[r.whoseTurn].cards)
+        if winningPlay != None:
+            deck = r.prefer_deck('tactics') # Arbitrary
+            return winningPlay + (deck,)
         return None
@@ -12,7 +12,7 @@ class TactfulPlayer(Player):
 
     def play(self, r):
         me = r.whoseTurn
-        mySlots = [i for i, f in enumerate(r.flags) if f.slots_left(me) > 0]
+        mySlots = r.open_flags(me)
 
         if len(mySlots) == 0:
             return None, None, None # Pass.
@@ -21,7 +21,7 @@ class TactfulPlayer(Player):
         tactics = [c for c in cards if c in TACTICS]
 
         if tactics != [] and r.tacticsAdvantage != 1-me: # Play tactics!
-            random.shuffle(tactics)
+            r.rng.shuffle(tactics)
             for card in tactics:
                 if is_playable(r, card):
                     target = self.play_tactics(r, card, mySlots, me)
@@ -30,10 +30,10 @@ class TactfulPlayer(Player):
         # Play troop.
         if len(tactics) == HAND_SIZE:
             return None, None, None # Pass if no troops in hand.
-        card = random.choice(cards)
+        card = r.rng.choice(cards)
         while card in TACTICS:
-            card = random.choice(cards)
-        target = random.choice(mySlots)
+            card = r.rng.choice(cards)
+        target = r.rng.choice(mySlots)
         return card, target, r.prefer_deck('tactics')
 
     def scout_discards(self, r):
@@ -43,37 +43,37 @@ class TactfulPlayer(Player):
         if troops == []:
             discardPool = cards
 
-        return random.sample(discardPool, 2)
+        return r.rng.sample(discardPool, 2)
 
     def play_tactics(self, r, card, mySlots, me):
         myCards   = [i for i, f in enumerate(r.flags) if f.has_card(me)]
         yourCards = [i for i, f in enumerate(r.flags) if f.has_card(1-me)]
 
         if card in ('Fo', 'Mu'):
-            return random.choice([i for i, f in enumerate(r.flags)
-                                  if f.winner == None])
+            return r.rng.choice([i for i, f in enumerate(r.flags)
+                                    if f.winner == None])
 
         if card == 'De':
-            f = random.choice(yourCards)
-            c = random.choice(r.flags[f].played[1-me])
+            f = r.rng.choice(yourCards)
+            c = r.rng.choice(r.flags[f].played[1-me])
             return c,
 
         if card == 'Tr':
-            c = random.choice(
+            c = r.rng.choice(
                     [card for flag in yourCards
                           for card in r.flags[flag].played[1-me]
                            if card not in TACTICS])
-            f2 = random.choice(mySlots)
+            f2 = r.rng.choice(mySlots)
             return c, f2
 
         if card == 'Re':
-            f1 = random.choice(myCards)
-            c  = random.choice(r.flags[f1].played[me])
-            f2 = random.choice(mySlots + [None])
+            f1 = r.rng.choice(myCards)
+            c  = r.rng.choice(r.flags[f1].played[me])
+            f2 = r.rng.choice(mySlots + (None,))
             return c, f2
 
         if card in ('Al', 'Da', 'Co', 'Sh'):
-            return random.choice(mySlots)
+            return r.rng.choice(mySlots)
 
         if card == 'Sc':
             return 'tactics', 'tactics', 'tactics'
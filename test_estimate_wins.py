@@ -0,0 +1,55 @@
+"""Tests of estimate_wins' cache (run with pytest)."""
+
+import multiprocessing, time
+from bl_classes import *
+from tournament import make_players
+
+
+def midgame_round(seed=0, nMoves=10):
+    """Return a seeded Round after a few moves between two Kennys."""
+    players = make_players(['kenny', 'kenny'])
+    r = Round(players, ['Kenny', 'Kenny'], False, rng=random.Random(seed))
+    r.generate_decks_and_deal_hands()
+    for i in range(nMoves):
+        r.apply_move(players[r.whoseTurn].play(r), players[r.whoseTurn])
+    r.undoStack = []
+    return r
+
+def test_cached_estimate_is_reused():
+    clear_caches()
+    r = midgame_round()
+    estimate = estimate_wins(r, nPlayouts=1000)
+    assert estimate.playouts == 1000
+    assert estimate_wins(r, nPlayouts=500) == estimate
+    assert cache_stats()['ESTIMATE_CACHE'].hits == 1
+
+def test_short_budget_keeps_larger_estimate():
+    clear_caches()
+    r = midgame_round()
+    estimate = estimate_wins(r, nPlayouts=2000)
+    assert estimate_wins(r, nPlayouts=2000, seconds=0.0) == estimate
+    assert estimate_wins(r, nPlayouts=4000, seconds=0.0).playouts > 2000
+    assert estimate_wins(r, nPlayouts=100).playouts > 2000
+
+def test_new_playouts_are_merged():
+    clear_caches()
+    r = midgame_round()
+    estimate_wins(r, nPlayouts=1000)
+    merged = estimate_wins(r, nPlayouts=3000)
+    assert merged.playouts == 3000
+    assert 0 <= merged.game <= 1
+    assert all(0 <= share <= 1 for share in merged.flags)
+    assert cache_stats()['ESTIMATE_CACHE'].misses == 2
+
+def test_time_budget_leaves_pool_free():
+    clear_caches()
+    r = midgame_round()
+    with multiprocessing.Pool(2) as pool:
+        start = time.perf_counter()
+        estimate = estimate_wins(r, nPlayouts=10**7, seconds=0.2, pool=pool)
+        assert time.perf_counter() - start < 2
+        start = time.perf_counter()
+        pool.apply(int)
+        assert time.perf_counter() - start < 1
+    assert 0 < estimate.playouts < 10**7
+    assert estimate_wins(r, nPlayouts=estimate.playouts) == estimate
@@ -0,0 +1,159 @@
+"""Machinery for playing many rounds of Battle Line, optionally in parallel.
+
+Intended to be imported into a wrapper (bl_wrapper).  Every round is seeded
+from the tournament seed and its own index, so a tournament gives the same
+results no matter how many worker processes share the work.
+
+In duplicate mode, each deal is played twice, with seats swapped.  Luck of
+the deal then mostly cancels out of each pair of rounds, so win rates from
+paired outcomes need far fewer rounds for the same confidence.
+"""
+
+import multiprocessing, math
+from play_bl import play_observed_round
+from bl_classes import Player
+from instrumentation import Timings
+from game_record import GameRecorder
+from players import *
+
+availablePlayers = {}
+playerClasses = Player.__subclasses__()
+while playerClasses != []: # Players may inherit other players (e.g., Sniper).
+    playerClass = playerClasses.pop()
+    availablePlayers[playerClass.get_name()] = playerClass
+    playerClasses += playerClass.__subclasses__()
+
+workerState = {} # Per-process players, names, seed, Timings, and recorder
+
+
+def make_players(playerNames):
+    """Instantiate one player per seat from their registered names."""
+    return [availablePlayers[name](i) for i, name in enumerate(playerNames)]
+
+def make_player_sets(playerNames, duplicate):
+    """Return players for each seating: as given, and (if duplicate)
+    swapped."""
+    playerSets = [make_players(playerNames)]
+    if duplicate:
+        playerSets.append(make_players(playerNames[::-1]))
+    return playerSets
+
+def round_seed(seed, iRound):
+    """Return the seed for one round of a tournament."""
+    return '{}:{}'.format(seed, iRound)
+
+def play_seeded_round(players, names, verbose, seed, iRound,
+                      timeControl=None, recorder=None):
+    """Play one round of a tournament and return a RoundResult."""
+    return play_observed_round(players, names, verbose,
+                               round_seed(seed, iRound), timeControl,
+                               recorder)
+
+def play_tournament_round(playerSets, names, verbose, seed, iRound,
+                          duplicate=False, timeControl=None, recorder=None):
+    """Play one round of a tournament and return a RoundResult.
+
+    In duplicate mode, rounds 2k and 2k + 1 share deal k, and seats are
+    swapped in the second.  Either way, the result lists the players in
+    their tournament order.
+    """
+    if not duplicate:
+        return play_seeded_round(playerSets[0], names, verbose, seed, iRound,
+                                 timeControl, recorder)
+    if iRound % 2 == 0:
+        return play_seeded_round(playerSets[0], names, verbose, seed,
+                                 iRound // 2, timeControl, recorder)
+    return swap_seats(play_seeded_round(playerSets[1], names[::-1], verbose,
+                                        seed, iRound // 2, timeControl,
+                                        recorder))
+
+def swap_seats(result):
+    """Return a RoundResult as if seen from the other seat."""
+    winner = result.winner
+    if winner != None:
+        winner = 1 - winner
+    return result._replace(winner=winner, flagsWon=result.flagsWon[::-1],
+                           overruns=result.overruns[::-1])
+
+def win_rate(scores, duplicate=False):
+    """Return a player's mean score and its standard error.
+
+    scores (list of float): Score in each round (1 per win, 0.5 per draw)
+    duplicate (bool): Whether rounds come in pairs on the same deal (then
+                      the error is that of the mean score per deal)
+    """
+    if duplicate:
+        scores = [(a + b) / 2 for a, b in zip(scores[::2], scores[1::2])]
+    n = len(scores)
+    mean = sum(scores) / n
+    if n < 2:
+        return mean, 0.0
+    variance = sum((s - mean)**2 for s in scores) / (n - 1)
+    return mean, math.sqrt(variance / n)
+
+def init_worker(playerNames, names, seed, duplicate, timeControl, timed,
+                recorded):
+    """Set up a worker process (players are built locally, not pickled)."""
+    workerState['players'] = make_player_sets(playerNames, duplicate)
+    workerState['names'] = names
+    workerState['seed'] = seed
+    workerState['duplicate'] = duplicate
+    workerState['timeControl'] = timeControl
+    workerState['timings'] = None
+    if timed: # Time for the life of the worker.
+        workerState['timings'] = Timings()
+        workerState['timings'].attach(sum(workerState['players'], []))
+    workerState['recorder'] = GameRecorder() if recorded else None
+
+def play_in_worker(iRound):
+    """Play one round.  Return its RoundResult, any new timings, and its
+    record (a line of the log), if recording."""
+    s = workerState
+    result = play_tournament_round(s['players'], s['names'], False, s['seed'],
+                                   iRound, s['duplicate'], s['timeControl'],
+                                   s['recorder'])
+    taken, lines = None, None
+    if s['timings'] != None:
+        taken = s['timings'].take()
+    if s['recorder'] != None:
+        lines = s['recorder'].take()
+    return result, taken, lines
+
+def play_rounds(playerNames, names, nRounds, seed, verbose=False, workers=1,
+                timings=None, timeControl=None, record=None, duplicate=False):
+    """Yield the RoundResult of each round, in round order.
+
+    timings (Timings): If given, time the players and engine into it
+    timeControl (TimeControl): If given, limit the players' time
+    record (file): If given, log every round to it (see game_record)
+    duplicate (bool): Whether to play each deal twice, swapping seats
+    """
+    if workers == 1:
+        playerSets = make_player_sets(playerNames, duplicate)
+        recorder = None if record == None else GameRecorder(record)
+        if timings != None:
+            timings.attach(sum(playerSets, []))
+        try:
+            for i in range(nRounds):
+                if verbose:
+                    print('\nROUND {}:'.format(i))
+                yield play_tournament_round(playerSets, names, verbose, seed,
+                                            i, duplicate, timeControl,
+                                            recorder)
+        finally:
+            if timings != None:
+                timings.detach()
+        return
+
+    chunkSize = max(1, nRounds // (8 * workers)) # Amortize IPC overhead.
+    with multiprocessing.Pool(workers, init_worker,
+                              (playerNames, names, seed, duplicate,
+                               timeControl, timings != None,
+                               record != None)) as pool:
+        for result, taken, lines in pool.imap(play_in_worker, range(nRounds),
+                                              chunkSize):
+            if taken != None:
+                timings.merge(*taken)
+            if lines != None:
+                record.writelines(line + '\n' for line in lines)
+            yield result